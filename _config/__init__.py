@@ -0,0 +1,114 @@
+from os import path
+import tempfile
+
+APP_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+SKIN_DIR = path.join(APP_DIR, 'view', 'generic')
+TEMPLATES_DIR = path.join(SKIN_DIR, 'templates')
+STATIC_DIR = path.join(SKIN_DIR, 'static')
+LOGFILE = APP_DIR + '/flask.log'
+DEBUG = True
+VOCAB_CACHE_DIR = path.join(tempfile.gettempdir(), 'vocprez', 'cache')
+VOCAB_CACHE_HOURS = 1 # Number of hours before cache is replaced (set to zero to always replace)
+VOCAB_CACHE_BACKEND = 'disk' # Where cached objects are kept: 'disk' (in VOCAB_CACHE_DIR, shared by all workers) or 'memory'
+VOCAB_CACHE_MAX_MB = 500 # Total size of cached objects before the least recently used are evicted
+VOCAB_SOURCE_WORKERS = 4 # Number of vocab sources to collect from at the same time
+VOCAB_SOURCE_TIMEOUT = 300 # Seconds a vocab source may take to collect before its previous vocabs are kept instead
+DEFAULT_LANGUAGE = 'en'
+SPARQL_QUERY_LIMIT = 2000 # Maximum number of results to return per SPARQL query
+MAX_RETRIES = 2 # Retries of a failed request to a SPARQL endpoint or API
+RETRY_BACKOFF_SECONDS = 0.5 # Retry n waits a random time of up to RETRY_BACKOFF_SECONDS * 2^n ...
+RETRY_BACKOFF_MAX_SECONDS = 5 # ... but no more than this
+RETRY_MAX_WAIT_SECONDS = 2 # Most seconds that the retries of one request may wait in all, so request threads aren't held up
+CIRCUIT_BREAKER_FAILURES = 5 # Consecutive failures after which requests to an endpoint fail fast ...
+CIRCUIT_BREAKER_RESET_SECONDS = 30 # ... for this long, before a trial request is let through
+SPARQL_TIMEOUT = 60
+HTTP_POOL_SIZE = 10 # Keep-alive connections kept open to each upstream SPARQL endpoint or API
+HTTP_POOL_SIZES = {} # Pool sizes for particular endpoints, e.g. {'http://sparql_endpoint.org': 20}
+SPARQL_QUERY_CACHE_SECONDS = 300 # Seconds for which SPARQL query results are reused (set to zero to disable)
+SPARQL_QUERY_CACHE_SIZE = 1000 # Maximum number of SPARQL query results kept in memory
+SPARQL_QUERY_WORKERS = 8 # Threads for making a page's independent SPARQL queries at the same time
+NARROWERS_CRAWL_WORKERS = 8 # Concepts whose Turtle is fetched at the same time when crawling for narrowers
+HIERARCHY_LAZY_LOAD_CONCEPTS = 1000 # Hierarchies this long show top concepts only, loading narrowers as they are expanded (None for all)
+HIERARCHY_INDEX_CACHE_SIZE = 50 # Maximum number of concept hierarchy indexes (narrowers, transitive closures) kept in memory
+LABEL_FALLBACK_LANGUAGES = ['en', ''] # Languages in which to look for a concept's labels, in order, when it has none in the one asked for ('' for no language tag)
+SEARCH_INDEX_WORKERS = 2 # Threads building the in-memory search indexes of vocabs' concept labels in the background
+SEARCH_RESULTS_CACHE_SECONDS = 300 # Seconds for which the results of a search across all vocabs are kept for paging (set to zero to disable)
+SEARCH_RESULTS_CACHE_SIZE = 100 # Maximum number of searches across all vocabs whose results are kept in memory
+EXPORT_PAGE_SIZE = 1000 # Concepts, or N-Triples triples, queried for at a time when streaming a vocab's export
+AUTOCOMPLETE_LIMIT = 10 # Concepts that autocomplete gives for a label prefix, unless asked for another number with limit
+AUTOCOMPLETE_RETRY_SECONDS = 5 # Seconds after which autocomplete asks to be retried (Retry-After) while a vocab's concepts are being indexed
+PURGE_TOKEN = None # Bearer token that POST /vocabulary/<vocab_id>/purge requires (None disables purging)
+PURGE_CHECK_SECONDS = 5 # Seconds between each worker's checks for a vocab having been purged by another worker
+MAX_PER_PAGE = 100 # Largest page size that registers and searches may be asked for with per_page
+LOCAL_URLS = True # Parameter governing whether URLs shown are local or external
+
+# Parameters for global SPARQL query endpoint
+SPARQL_ENDPOINT = 'http://sparql_endpoint.org'
+SPARQL_USERNAME = 'sparql_user'
+SPARQL_PASSWORD = 'sparql_password'
+
+# VocBench parameters
+VB_ENDPOINT = ''
+VB_USER = ''
+VB_PASSWORD = ''
+# 'paths' gets a concept hierarchy with one property path query. 'edges' pages through its broader/narrower edges
+# instead, for projects too large for the triplestore to group in memory
+VB_HIERARCHY_MODE = 'paths'
+VB_HIERARCHY_PAGE_SIZE = 10000 # Edges per query in 'edges' mode
+VB_HIERARCHY_MODES = {} # VocBench project (vocab_id) -> 'paths' or 'edges', for projects that need other than VB_HIERARCHY_MODE
+
+TITLE = 'VocPrez'
+
+#
+#   Vocabulary data sources
+#
+# Here is the list of vocabulary sources that this instance uses. FILE, SPARQL, RVA & VOCBENCH are implemented already
+# and are on by default (e.g. VOCBENCH = None) but other sources, such as GitHub can be added. To enable them, add a new
+# like like VocBench.XXX = None
+class VocabSource:
+    FILE = 'FILE'
+    SPARQL = 'SPARQL'
+    RVA = 'RVA'
+    VOCBENCH = 'VOCBENCH'
+    GITHUB = 'GITHUB'
+
+
+VOCAB_SOURCES = {
+    # an example of a SPARQL endpoint - here supplied by an instance of GrpahDB
+    'gsq-graphdb': {
+        'source': VocabSource.SPARQL,
+        'sparql_endpoint': ''
+    },
+    # an example of querying the ARDC RVA vocab system (https://vocabs.ands.org.au)
+    'rva': {
+        'source': VocabSource.RVA,
+        'api_endpoint': '',
+        'vocabs': [
+            {
+                'ardc_id': -99,
+                'uri': '',
+            },
+            {
+                'ardc_id': -99,
+                'uri': '',
+            },
+            {
+                'ardc_id': -99,
+                'uri': '',
+            }
+        ]
+    },
+    #===========================================================================
+    # 'ga-jena-fuseki': {
+    #     'source': VocabSource.SPARQL,
+    #     'sparql_endpoint': 'http://sparql_endpoint.org',
+    #     'sparql_username': 'sparql_user',
+    #     'sparql_password': 'sparql_password',
+    #     'uri_filter_regex': '.*', # Regular expression to filter vocabulary URIs - Everything
+    #     #'uri_filter_regex': '^http(s?)://pid.geoscience.gov.au/def/voc/ga/', # Regular expression to filter vocabulary URIs - GA
+    #     #'uri_filter_regex': '^https://gcmdservices.gsfc.nasa.gov', # Regular expression to filter vocabulary URIs - GCMD
+    #     #'uri_filter_regex': '^http(s?)://resource.geosciml.org/', # Regular expression to filter vocabulary URIs - CGI
+    #     #'hierarchy_page_size': 10000, # Fetch concept hierarchies in pages of this many edges, for large vocabs
+    # },  
+    #===========================================================================
+}
@@ -0,0 +1,90 @@
+"""
+Benchmark of data.hierarchy.build_hierarchy() against the recursive builder it replaced, on generated vocabularies
+
+Run with `python -m _tests.benchmark_hierarchy` from the repository root. The time per concept of build_hierarchy()
+should stay roughly constant as the vocabulary grows, whereas that of the old builder grows with the vocabulary's size.
+"""
+import random
+import time
+from data.hierarchy import build_hierarchy
+
+SIZES = [2500, 5000, 10000, 20000, 40000]
+OLD_BUILDER_MAX_SIZE = 10000  # the old builder takes minutes beyond this
+
+
+def make_bindings(size, branching=6, polyhierarchy=0.05, seed=0):
+    """
+    :return: concept hierarchy query bindings for a vocabulary of size concepts, some with a second broader concept
+    """
+    rnd = random.Random(seed)
+    bindings = []
+    for i in range(size):
+        concept = {'type': 'uri', 'value': 'http://example.com/concept/{}'.format(i)}
+        label = {'type': 'literal', 'value': 'Concept {}'.format(rnd.random())}
+        broaders = [(i - 1) // branching] if i > 0 else []
+        if i > 1 and rnd.random() < polyhierarchy:
+            broaders.append(rnd.randrange(0, i - 1))
+        if not broaders:
+            bindings.append({'concept': concept, 'concept_preflabel': label})
+        for broader in set(broaders):
+            bindings.append({
+                'concept': concept,
+                'concept_preflabel': label,
+                'broader_concept': {'type': 'uri', 'value': 'http://example.com/concept/{}'.format(broader)},
+            })
+    return bindings
+
+
+def old_build_hierarchy(bindings_list, broader_concept=None, level=0):
+    # the builder previously nested in Source.get_concept_hierarchy(), for comparison
+    level += 1
+    hierarchy = []
+    narrower_list = sorted([binding_dict
+                            for binding_dict in bindings_list
+                            if ((broader_concept is None) and (binding_dict.get('broader_concept') is None))
+                            or ((binding_dict.get('broader_concept') is not None)
+                                and (binding_dict['broader_concept']['value'] == broader_concept))
+                            ], key=lambda binding_dict: binding_dict['concept_preflabel']['value'])
+    for binding_dict in narrower_list:
+        concept = binding_dict['concept']['value']
+        hierarchy += [(level,
+                       concept,
+                       binding_dict['concept_preflabel']['value'],
+                       binding_dict['broader_concept']['value'] if binding_dict.get('broader_concept') else None,
+                       )] + old_build_hierarchy(bindings_list, concept, level)
+    return hierarchy
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    print('{:>8} {:>10} {:>12} {:>14} {:>12} {:>14}'.format(
+        'concepts', 'items', 'new (s)', 'new (us/item)', 'old (s)', 'old (us/item)'))
+    for size in SIZES:
+        bindings = make_bindings(size)
+        hierarchy, new_seconds = timed(build_hierarchy, bindings)
+        old = ''
+        old_per_item = ''
+        if size <= OLD_BUILDER_MAX_SIZE:
+            old_hierarchy, old_seconds = timed(old_build_hierarchy, bindings)
+            assert old_hierarchy == hierarchy, 'builders disagree for {} concepts'.format(size)
+            old = '{:.3f}'.format(old_seconds)
+            old_per_item = '{:.1f}'.format(old_seconds / len(hierarchy) * 1e6)
+        print('{:>8} {:>10} {:>12.3f} {:>14.1f} {:>12} {:>14}'.format(
+            size, len(hierarchy), new_seconds, new_seconds / len(hierarchy) * 1e6, old, old_per_item))
+
+    # a cycle, which the old builder can't handle, and a chain deeper than the recursion limit
+    cycle = make_bindings(3) + [{'concept': {'value': 'http://example.com/concept/0'},
+                                 'concept_preflabel': {'value': 'Concept 0'},
+                                 'broader_concept': {'value': 'http://example.com/concept/2'}}]
+    print('cycle: {} items'.format(len(build_hierarchy(cycle))))
+    chain = make_bindings(20000, branching=1, polyhierarchy=0)
+    print('chain: {} levels'.format(build_hierarchy(chain)[-1][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import pickle
+import pytest
+from data import cache
+from data.cache import DiskCacheStore, TTLCache
+
+
+def test_disk_cache_store_round_trip(tmp_path):
+    store = DiskCacheStore(str(tmp_path))
+    assert store.get('A.p') is None
+    store.set('A.p', {'a': [1, 2]})
+    assert store.get('A.p') == {'a': [1, 2]}
+    assert store.get('A.p', max_age=60) == {'a': [1, 2]}
+    assert store.age('A.p') < 60
+    store.delete('A.p')
+    assert store.get('A.p') is None
+    assert store.stats()['hits'] == 2 and store.stats()['misses'] == 2
+
+
+def test_disk_cache_store_evicts_least_recently_used(tmp_path):
+    value = 'x' * 100
+    size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    store = DiskCacheStore(str(tmp_path), max_bytes=size * 2)
+    store.set('A.p', value)
+    store.set('B.p', value)
+    # A was stored first but used last
+    os.utime(str(tmp_path / 'A.p'), (2000, 1000))
+    os.utime(str(tmp_path / 'B.p'), (1000, 1000))
+    store.set('C.p', value)
+    assert store.get('A.p') == value
+    assert store.get('B.p') is None
+    assert store.get('C.p') == value
+    assert store.size() == size * 2
+    assert store.evictions == 1
+
+
+def test_disk_cache_store_keeps_the_object_just_stored(tmp_path):
+    store = DiskCacheStore(str(tmp_path), max_bytes=10)
+    store.set('A.p', 'x' * 100)
+    assert store.get('A.p') == 'x' * 100
+
+
+def test_disk_cache_store_writes_atomically(tmp_path, monkeypatch):
+    store = DiskCacheStore(str(tmp_path))
+    store.set('A.p', 'old')
+
+    def fail(src, dst):
+        raise OSError('disk full')
+    monkeypatch.setattr(cache.os, 'replace', fail)
+    with pytest.raises(OSError):
+        store.set('A.p', 'new')
+    # the object stored before is still whole, and the partly written temporary file is gone
+    assert store.get('A.p') == 'old'
+    assert sorted(os.listdir(str(tmp_path))) == ['.lock', 'A.p']
+
+
+def test_disk_cache_store_drops_unreadable_objects(tmp_path):
+    store = DiskCacheStore(str(tmp_path))
+    with open(str(tmp_path / 'A.p'), 'wb') as f:
+        f.write(b'not a pickle')
+    assert store.get('A.p') is None
+    assert not os.path.exists(str(tmp_path / 'A.p'))
+
+
+def test_ttl_cache_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    ttl_cache = TTLCache(ttl=10, max_entries=5)
+    ttl_cache.set('a', 1)
+    now[0] += 10
+    assert ttl_cache.get('a') == 1
+    now[0] += 1
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.stats()['entries'] == 0
+    assert ttl_cache.stats()['hits'] == 1 and ttl_cache.stats()['misses'] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    ttl_cache = TTLCache(ttl=60, max_entries=2)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    ttl_cache.get('a')
+    ttl_cache.set('c', 3)
+    assert ttl_cache.get('b') is None
+    assert ttl_cache.get('a') == 1 and ttl_cache.get('c') == 3
+    assert ttl_cache.stats()['evictions'] == 1
+
+
+def test_ttl_cache_invalidates_by_tag():
+    ttl_cache = TTLCache(ttl=60, max_entries=10)
+    ttl_cache.set('a1', 1, tag='a')
+    ttl_cache.set('a2', 2, tag='a')
+    ttl_cache.set('b1', 3, tag='b')
+    ttl_cache.set('a2', 4, tag='b')  # retagged when replaced
+    ttl_cache.invalidate(tag='a')
+    assert ttl_cache.get('a1') is None
+    assert ttl_cache.get('a2') == 4 and ttl_cache.get('b1') == 3
+    ttl_cache.invalidate()
+    assert ttl_cache.get('a2') is None and ttl_cache.get('b1') is None
+
+
+def test_ttl_cache_disabled():
+    ttl_cache = TTLCache(ttl=0, max_entries=10)
+    ttl_cache.set('a', 1)
+    assert ttl_cache.get('a') is None
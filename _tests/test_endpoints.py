@@ -1,6 +1,7 @@
 import requests
 import json
 import re
+import _config as config
 
 BASE_URLS = [
     'http://localhost:5000',
@@ -26,6 +27,13 @@ def test_about_html():
                'vocabularies.</p>' in content, BASE_URL
 
 
+def test_status_json():
+    for BASE_URL in BASE_URLS:
+        content = json.loads(requests.get(BASE_URL + '/status').content.decode('utf-8'))
+        assert content['registry']['vocabs'] > 0, BASE_URL
+        assert 'last_refresh' in content['registry'] and 'last_refresh_duration' in content['registry'], BASE_URL
+
+
 #
 # -- Test vocabulary register ------------------------------------------------------------------------------------------
 #
@@ -45,6 +53,13 @@ def test_vocabulary_register_reg_view_html():
         assert 'Search <em>Vocabularies:</em><br>' in content, BASE_URL
 
 
+def test_vocabulary_register_reg_view_html_facets():
+    for BASE_URL in BASE_URLS:
+        content = requests.get(BASE_URL + '/vocabulary/?source=FILE').content.decode('utf-8')
+        assert '<li><strong>FILE</strong>' in content, BASE_URL
+        assert 'Contact Type - File' in content, BASE_URL
+
+
 def test_vocabulary_register_reg_view_turtle():
     for BASE_URL in BASE_URLS:
         content = requests.get(BASE_URL + '/vocabulary/?vocab_id=&_view=reg&_format=text/turtle&uri=' + BASE_URL +
@@ -426,6 +441,78 @@ def test_file_vocabulary_instance_alternates_view_app_json():
         assert content['default_view'] == 'dcat', BASE_URL
 
 
+def test_file_vocabulary_instance_narrowers_json():
+    for BASE_URL in BASE_URLS:
+        content = json.loads(requests.get(BASE_URL + '/vocabulary/contact_type/narrowers').content.decode('utf-8'))
+        assert content['uri'] is None, BASE_URL
+        for narrower in content['narrowers']:
+            assert set(narrower.keys()) == {'uri', 'label', 'narrowers', 'link'}, BASE_URL
+
+
+def test_file_vocabulary_instance_closure_json():
+    for BASE_URL in BASE_URLS:
+        content = json.loads(requests.get(
+            BASE_URL + '/vocabulary/contact_type/closure?uri=http%3A//resource.geosciml.org/classifier/cgi/contacttype/'
+                       'faulted_contact&under=http%3A//resource.geosciml.org/classifier/cgi/contacttype/contact'
+        ).content.decode('utf-8'))
+        assert content['is_under'] is True, BASE_URL
+        assert 'http://resource.geosciml.org/classifier/cgi/contacttype/contact' in \
+            [ancestor['uri'] for ancestor in content['ancestors']], BASE_URL
+
+
+def test_file_vocabulary_instance_purge_json():
+    for BASE_URL in BASE_URLS:
+        assert requests.post(BASE_URL + '/vocabulary/contact_type/purge').status_code == 403, BASE_URL
+        if not getattr(config, 'PURGE_TOKEN', None):
+            continue
+        headers = {'Authorization': 'Bearer ' + config.PURGE_TOKEN}
+        content = json.loads(requests.post(BASE_URL + '/vocabulary/contact_type/purge', headers=headers)
+                             .content.decode('utf-8'))
+        assert content == {'vocab_id': 'contact_type', 'purged': True}, BASE_URL
+        assert requests.get(BASE_URL + '/vocabulary/contact_type').status_code == 200, BASE_URL
+        assert requests.post(BASE_URL + '/vocabulary/no_such_vocab/purge', headers=headers).status_code == 404, \
+            BASE_URL
+
+
+def test_file_vocabulary_instance_autocomplete_json():
+    for BASE_URL in BASE_URLS:
+        content = json.loads(requests.get(
+            BASE_URL + '/vocabulary/contact_type/autocomplete?search=fault&limit=3').content.decode('utf-8'))
+        assert len(content['results']) <= 3, BASE_URL
+        assert 'http://resource.geosciml.org/classifier/cgi/contacttype/faulted_contact' in \
+            [result['uri'] for result in content['results']], BASE_URL
+        assert requests.get(BASE_URL + '/vocabulary/contact_type/autocomplete').status_code == 400, BASE_URL
+
+
+def test_file_vocabulary_instance_label_language_fallback():
+    for BASE_URL in BASE_URLS:
+        # a language that the vocab has no labels in falls back to the same labels as the default language
+        default = requests.get(BASE_URL + '/vocabulary/contact_type/autocomplete?search=fault').content.decode('utf-8')
+        fallback = requests.get(BASE_URL + '/vocabulary/contact_type/autocomplete?search=fault&lang=xx')\
+            .content.decode('utf-8')
+        assert json.loads(default)['results'] == json.loads(fallback)['results'], BASE_URL
+
+
+def test_file_vocabulary_instance_export():
+    for BASE_URL in BASE_URLS:
+        r = requests.get(BASE_URL + '/vocabulary/contact_type/export?format=csv')
+        assert r.headers['Content-Type'].startswith('text/csv'), BASE_URL
+        assert r.content.decode('utf-8').startswith('uri,prefLabel,definition,created,modified\n'), BASE_URL
+        lines = requests.get(BASE_URL + '/vocabulary/contact_type/export?format=jsonl').content.decode('utf-8').splitlines()
+        assert 'http://resource.geosciml.org/classifier/cgi/contacttype/faulted_contact' in \
+            [json.loads(line)['uri'] for line in lines], BASE_URL
+        assert requests.get(BASE_URL + '/vocabulary/contact_type/export?format=xml').status_code == 400, BASE_URL
+
+
+def test_search_json():
+    for BASE_URL in BASE_URLS:
+        content = json.loads(requests.get(BASE_URL + '/search?search=faulted&per_page=5').content.decode('utf-8'))
+        assert content['per_page'] == 5, BASE_URL
+        assert {'uri': 'http://resource.geosciml.org/classifier/cgi/contacttype/faulted_contact',
+                'vocab_id': 'contact_type'} in \
+            [{'uri': result['uri'], 'vocab_id': result['vocab_id']} for result in content['results']], BASE_URL
+        assert requests.get(BASE_URL + '/search').status_code == 400, BASE_URL
+
 #
 # -- Test Vocabulary Instance's Concept Register -----------------------------------------------------------------------
 #
@@ -0,0 +1,118 @@
+from data.hierarchy import HierarchyClosure, build_hierarchy
+
+
+def bindings(*edges):
+    # concept hierarchy query bindings of (concept, prefLabel, broader concept or None) edges
+    return [dict([('concept', {'value': concept}), ('concept_preflabel', {'value': preflabel})] +
+                 ([('broader_concept', {'value': broader})] if broader else []))
+            for concept, preflabel, broader in edges]
+
+
+def test_build_hierarchy_orders_by_preflabel_depth_first():
+    assert build_hierarchy(bindings(
+        ('B', 'b', None),
+        ('A', 'a', None),
+        ('D', 'd', 'A'),
+        ('C', 'c', 'A'),
+        ('E', 'e', 'C'),
+        ('C', 'c', 'A'),  # duplicate rows, as from several graphs, appear once
+    )) == [
+        (1, 'A', 'a', None),
+        (2, 'C', 'c', 'A'),
+        (3, 'E', 'e', 'C'),
+        (2, 'D', 'd', 'A'),
+        (1, 'B', 'b', None),
+    ]
+
+
+def test_build_hierarchy_polyhierarchy():
+    assert build_hierarchy(bindings(
+        ('A', 'a', None),
+        ('B', 'b', None),
+        ('C', 'c', 'A'),
+        ('C', 'c', 'B'),
+        ('D', 'd', 'C'),
+    )) == [
+        (1, 'A', 'a', None),
+        (2, 'C', 'c', 'A'),
+        (3, 'D', 'd', 'C'),
+        (1, 'B', 'b', None),
+        (2, 'C', 'c', 'B'),
+        (3, 'D', 'd', 'C'),
+    ]
+
+
+def test_build_hierarchy_cycle():
+    # C's broader B is also its narrower, and E is its own broader
+    assert build_hierarchy(bindings(
+        ('A', 'a', None),
+        ('B', 'b', 'A'),
+        ('C', 'c', 'B'),
+        ('B', 'b', 'C'),
+        ('E', 'e', None),
+        ('E', 'e', 'E'),
+    )) == [
+        (1, 'A', 'a', None),
+        (2, 'B', 'b', 'A'),
+        (3, 'C', 'c', 'B'),
+        (1, 'E', 'e', None),
+    ]
+
+
+def test_build_hierarchy_deep():
+    depth = 5000
+    hierarchy = build_hierarchy(bindings(('C0', 'c', None), *(('C{}'.format(i), 'c', 'C{}'.format(i - 1))
+                                                               for i in range(1, depth))))
+    assert len(hierarchy) == depth
+    assert hierarchy[-1] == (depth, 'C{}'.format(depth - 1), 'c', 'C{}'.format(depth - 2))
+
+
+# A, with D under it and E under D, and C under B, which isn't listed itself, two levels below A's level, as the
+# VocBench source's path-length query can give
+LEVEL_JUMP_HIERARCHY = [
+    (1, 'A', 'a', None),
+    (3, 'C', 'c', 'B'),
+    (2, 'D', 'd', 'A'),
+    (4, 'E', 'e', 'D'),
+]
+
+
+def test_closure_level_jump():
+    closure = HierarchyClosure(LEVEL_JUMP_HIERARCHY)
+    assert closure.ancestors('C') == ['B']
+    assert closure.descendants('A') == ['D', 'E']
+    assert closure.descendants('B') == ['C']
+    assert closure.ancestors('E') == ['A', 'D']
+    assert closure.path('E') == ['A', 'D']
+    assert closure.is_under('E', 'A')
+    assert not closure.is_under('C', 'A')
+    assert 'C' in closure and 'B' not in closure
+
+
+def test_closure_polyhierarchy():
+    closure = HierarchyClosure([
+        (1, 'A', 'a', None),
+        (2, 'C', 'c', 'A'),
+        (3, 'D', 'd', 'C'),
+        (1, 'B', 'b', None),
+        (2, 'C', 'c', 'B'),
+        (3, 'D', 'd', 'C'),
+    ])
+    assert closure.ancestors('D') == ['A', 'C', 'B']
+    assert closure.path('D') == ['A', 'C']
+    assert closure.descendants('A') == ['C', 'D']
+    assert closure.descendants('B') == ['C', 'D']
+    assert closure.labels['D'] == 'd'
+
+
+def test_closure_cycle():
+    closure = HierarchyClosure([
+        (1, 'A', 'a', None),
+        (2, 'B', 'b', 'A'),
+        (3, 'C', 'c', 'B'),
+        (4, 'B', 'b', 'C'),
+    ])
+    assert closure.ancestors('B') == ['A', 'C']
+    assert closure.descendants('B') == ['C']
+    assert closure.path('C') == ['A', 'B']
+    assert not closure.is_under('B', 'B')
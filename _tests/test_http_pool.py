@@ -0,0 +1,95 @@
+import pytest
+import requests
+from data import http_pool as hp
+from data.http_pool import CircuitBreaker, CircuitOpenError, HttpPool
+
+ENDPOINT = 'http://example.com'
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_request(ENDPOINT)
+        breaker.record_failure(ENDPOINT)
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    breaker.record_failure(ENDPOINT)
+    breaker.record_failure(ENDPOINT)
+    breaker.record_success()  # resets the count
+    breaker.record_failure(ENDPOINT)
+    breaker.record_failure(ENDPOINT)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure(ENDPOINT)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(ENDPOINT)
+    assert breaker.stats()['rejected'] == 1
+    assert breaker.stats()['times_opened'] == 1
+
+
+def test_circuit_breaker_half_open_trial_closes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    breaker.before_request(ENDPOINT)  # the trial
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(ENDPOINT)  # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_request(ENDPOINT)
+
+
+def test_circuit_breaker_half_open_trial_reopens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    breaker.before_request(ENDPOINT)
+    breaker.record_failure(ENDPOINT)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()['times_opened'] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(ENDPOINT)
+
+
+def test_circuit_breaker_stale_trial_is_replaced():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 30
+    breaker.before_request(ENDPOINT)  # a trial that never reports back
+    breaker.trial_at -= 30
+    breaker.before_request(ENDPOINT)  # let through as the new trial
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_backoff_delay_bounds():
+    pool = HttpPool(backoff_seconds=0.5, backoff_max_seconds=3)
+    for attempt in range(8):
+        for _ in range(50):
+            assert 0 <= pool.backoff_delay(attempt) <= min(3, 0.5 * 2 ** attempt)
+
+
+class FailingSession:
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        raise requests.ConnectionError('refused')
+
+
+def test_retries_stop_at_max_wait(monkeypatch):
+    slept = []
+    monkeypatch.setattr(hp.time, 'sleep', slept.append)
+    pool = HttpPool(max_retries=10, backoff_seconds=1, backoff_max_seconds=1, max_wait_seconds=2.5,
+                    breaker_failures=100)
+    monkeypatch.setattr(pool, 'backoff_delay', lambda attempt: 1)
+    pool.session(ENDPOINT)
+    session = pool._sessions[ENDPOINT] = FailingSession()
+    with pytest.raises(requests.ConnectionError):
+        pool.get(ENDPOINT + '/sparql')
+    assert slept == [1, 1]
+    assert session.calls == 3
@@ -0,0 +1,53 @@
+import _config as config
+from data.labels import LabelStore
+
+CONCEPTS = {
+    'http://ex/a': {'prefLabel': {'de': ['Granit'], 'en': ['Granite']}, 'definition': {'': ['A rock']}},
+    'http://ex/b': {'prefLabel': {'en': ['Basalt']}, 'altLabel': {'fr': ['Basalte']}},
+    'http://ex/c': {'prefLabel': {'': ['Chert']}},
+    'http://ex/d': {'prefLabel': {'ja': ['閃緑岩']}},
+}
+
+
+def test_fallback_chain(monkeypatch):
+    monkeypatch.setattr(config, 'LABEL_FALLBACK_LANGUAGES', ['en', ''], raising=False)
+    assert LabelStore.fallback_chain('de') == ('de', 'en', '')
+    assert LabelStore.fallback_chain('EN') == ('en', '')
+    assert LabelStore.fallback_chain(None) == ('', 'en')
+    monkeypatch.setattr(config, 'LABEL_FALLBACK_LANGUAGES', ['fr', 'EN'])
+    assert LabelStore.fallback_chain('de') == ('de', 'fr', 'en')
+
+
+def test_get_falls_back(monkeypatch):
+    monkeypatch.setattr(config, 'LABEL_FALLBACK_LANGUAGES', ['en', ''], raising=False)
+    store = LabelStore('v', CONCEPTS)
+    assert store.get('http://ex/a', 'prefLabel', 'de') == ['Granit']
+    assert store.get('http://ex/b', 'prefLabel', 'de') == ['Basalt']
+    assert store.get('http://ex/c', 'prefLabel', 'de') == ['Chert']
+    assert store.get('http://ex/a', 'definition', 'de') == ['A rock']
+    assert store.get('http://ex/b', 'altLabel', 'de') == []
+    assert store.get('http://ex/b', 'altLabel', 'fr') == ['Basalte']
+    assert store.get('http://ex/d', 'prefLabel', 'de') == []
+    assert store.get('http://ex/x', 'prefLabel', 'de') == []
+
+
+def test_label_language(monkeypatch):
+    monkeypatch.setattr(config, 'LABEL_FALLBACK_LANGUAGES', ['en', ''], raising=False)
+    store = LabelStore('v', CONCEPTS)
+    assert store.languages() == ['', 'de', 'en', 'fr', 'ja']
+    assert store.label_language('de') == 'de'
+    # no labels in Italian, so its labels are those of English
+    assert store.label_language('it') == 'en'
+
+
+def test_concepts(monkeypatch):
+    monkeypatch.setattr(config, 'LABEL_FALLBACK_LANGUAGES', ['en', ''], raising=False)
+    store = LabelStore('v', CONCEPTS)
+    assert [(concept['uri'], concept['title'], concept['definition']) for concept in store.concepts('de')] == [
+        ('http://ex/b', 'Basalt', None),
+        ('http://ex/c', 'Chert', None),
+        ('http://ex/a', 'Granit', 'A rock'),
+    ]
+    # those with a prefLabel only in a language outside the chain are left out
+    assert [concept['title'] for concept in store.concepts('it')] == ['Basalt', 'Chert', 'Granite']
+    assert [concept['title'] for concept in store.concepts('ja')] == ['Basalt', 'Chert', 'Granite', '閃緑岩']
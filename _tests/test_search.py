@@ -0,0 +1,81 @@
+from data.search import LabelIndex, normalise
+
+
+def index(*labels):
+    # an index of items named by their prefLabel, with the (field, label) pairs given for each
+    return LabelIndex((item[0][1], {field: [label] for field, label in item}) for item in labels)
+
+
+def test_normalise():
+    assert normalise('  Igneous-Rock, (Felsic) ') == 'igneous rock felsic'
+
+
+def test_search_ranks_by_field_and_match():
+    labels = index(
+        [('prefLabel', 'Granite')],
+        [('prefLabel', 'Granite porphyry')],
+        [('prefLabel', 'Alkali granite')],
+        [('prefLabel', 'Pegmatite'), ('altLabel', 'Granite pegmatite')],
+        [('prefLabel', 'Syenogranite')],
+        [('prefLabel', 'Basalt'), ('definition', 'Not a granite')],
+    )
+    assert [(item, label) for item, label, _score in labels.search('granite')] == [
+        ('Granite', 'Granite'),  # the whole prefLabel
+        ('Granite porphyry', 'Granite porphyry'),  # the start of it
+        ('Alkali granite', 'Alkali granite'),  # the start of a word in it
+        ('Pegmatite', 'Granite pegmatite'),  # the start of an altLabel
+        ('Syenogranite', 'Syenogranite'),  # anywhere in it
+        ('Basalt', 'Not a granite'),  # a word in the definition
+    ]
+
+
+def test_search_ignores_case_and_punctuation():
+    labels = index([('prefLabel', 'Sand-stone')], [('prefLabel', 'Sandstone')])
+    assert [item for item, _label, _score in labels.search('SAND STONE')] == ['Sand-stone']
+    assert [item for item, _label, _score in labels.search('sandstone')] == ['Sandstone']
+
+
+def test_search_short_queries():
+    labels = index([('prefLabel', 'Tuff')], [('prefLabel', 'Ash')], [('prefLabel', 'Q')])
+    assert [item for item, _label, _score in labels.search('uf')] == ['Tuff']
+    assert [item for item, _label, _score in labels.search('q')] == ['Q']
+    assert labels.search('') == []
+    assert labels.search('zz') == []
+
+
+def test_search_needs_every_trigram():
+    labels = index([('prefLabel', 'Mudstone')], [('prefLabel', 'Mud')], [('prefLabel', 'Stone')])
+    assert [item for item, _label, _score in labels.search('mudst')] == ['Mudstone']
+    assert labels.search('mudsand') == []
+
+
+def test_complete_prefers_label_starts_then_word_starts():
+    labels = index(
+        [('prefLabel', 'Red clay')],
+        [('prefLabel', 'Claystone')],
+        [('prefLabel', 'Clay')],
+        [('prefLabel', 'Shale'), ('altLabel', 'Clay shale')],
+        [('prefLabel', 'Siltstone')],
+    )
+    assert [(item, label) for item, label, _score in labels.complete('cla', 10)] == [
+        ('Clay', 'Clay'),  # prefLabels starting with it, in label order
+        ('Claystone', 'Claystone'),
+        ('Red clay', 'Red clay'),  # a later word of a prefLabel
+        ('Shale', 'Clay shale'),  # an altLabel starting with it
+    ]
+
+
+def test_complete_gives_each_item_once_up_to_limit():
+    labels = index(
+        [('prefLabel', 'Clay clay')],
+        [('prefLabel', 'Clay'), ('altLabel', 'Clay mineral')],
+        [('prefLabel', 'Claystone')],
+    )
+    assert [item for item, _label, _score in labels.complete('clay', 10)] == ['Clay', 'Clay clay', 'Claystone']
+    assert [item for item, _label, _score in labels.complete('clay', 2)] == ['Clay', 'Clay clay']
+    assert labels.complete('', 10) == []
+
+
+def test_complete_ignores_definitions():
+    labels = index([('prefLabel', 'Shale'), ('definition', 'Clay rich rock')])
+    assert labels.complete('clay', 10) == []
@@ -3,7 +3,7 @@ import _config as config
 from flask import Flask, g
 from controller import routes
 import helper
-import data.source as source
+from data.registry import registry
 
 
 app = Flask(__name__, template_folder=config.TEMPLATES_DIR, static_folder=config.STATIC_DIR)
@@ -13,31 +13,14 @@ app.register_blueprint(routes.routes)
 @app.before_request
 def before_request():
     """
-    Runs before every request and populates vocab index either from disk (VOCABS.p) or from a complete reload by
-    calling collect() for each of the vocab sources defined in config/__init__.py -> VOCAB_SOURCES
+    Runs before every request and hands it a read-only view of this worker's vocab index (g.VOCABS). The index itself
+    is loaded once per process by the registry, either from disk (VOCAB_SOURCES.p) or from a complete reload by calling
+    collect() for each of the vocab sources defined in config/__init__.py -> VOCAB_SOURCES
     :return: nothing
     """
-    # check to see if g.VOCABS exists, if so, do nothing
-    if hasattr(g, 'VOCABS'):
-        return
-    
-
-    # we have no g.VOCABS so try and load it from a pickled VOCABS.p file
-    g.VOCABS = helper.cache_read('VOCABS.p')
-
-    if not g.VOCABS:
-        # we haven't been able to load from VOCABS.p so run collect() on each vocab source to recreate it
-
-        # check each vocab source and,
-        # using the appropriate class (from details['source']),
-        # load all the vocabs from it into this session's (g) VOCABS variable
-        g.VOCABS = {}
-        for _name, details in config.VOCAB_SOURCES.items():
-            getattr(source, details['source']).collect(details)
-    
-        # also load all vocabs into VOCABS.p on disk for future use
-        helper.cache_write(g.VOCABS, 'VOCABS.p')
-        
+    g.VOCABS = registry.vocabs
+
+
 @app.context_processor
 def context_processor():
     """
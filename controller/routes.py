@@ -1,4 +1,5 @@
-from flask import Blueprint, Response, request, render_template, Markup, g, redirect, url_for, send_file
+from flask import Blueprint, Response, request, render_template, Markup, g, redirect, url_for, send_file, jsonify, \
+    stream_with_context
 from model.vocabulary import VocabularyRenderer
 from model.concept import ConceptRenderer
 from model.collection import CollectionRenderer
@@ -7,11 +8,16 @@ import _config as config
 import markdown
 from data.source._source import Source
 from data.source.VOCBENCH import VbException
+from data.registry import registry
+from data.http_pool import http_pool
+from data.search import search_index
+import hmac
 import json
 from pyldapi import Renderer
 import controller.sparql_endpoint_functions
 import datetime
 import logging
+import helper as h
 
 routes = Blueprint('routes', __name__)
 
@@ -88,43 +94,34 @@ def get_a_vocab_source_key():
         return None
 
 
-def match(vocabs, query):
+def get_page_args():
     """
-    Generate a generator of vocabulary items that match the search query
+    Get the page number and page size of a register from the 'page' and 'per_page' query string arguments, the page
+    size being at most MAX_PER_PAGE.
 
-    :param vocabs: The vocabulary list of items.
-    :param query: The search query string.
-    :return: A generator of words that match the search query.
-    :rtype: generator
+    :return: (page, per_page)
+    :rtype: tuple
     """
-    for word in vocabs:
-        if query.lower() in word.title.lower():
-            yield word
+    page = int(request.values.get('page')) if request.values.get('page') is not None else 1
+    per_page = int(request.values.get('per_page')) if request.values.get('per_page') is not None else 20
+    return max(page, 1), min(max(per_page, 1), getattr(config, 'MAX_PER_PAGE', 100))
 
 
 @routes.route('/vocabulary/')
 def vocabularies():
-    page = int(request.values.get('page')) if request.values.get('page') is not None else 1
-    per_page = int(request.values.get('per_page')) if request.values.get('per_page') is not None else 20
+    page, per_page = get_page_args()
 
-    # TODO: replace this logic with the following
-    #   1. read all static vocabs from g.VOCABS
-    # get this instance's list of vocabs
-    vocabs = []  # local copy (to this request) for sorting
-    for k, voc in g.VOCABS.items():
-        vocabs.append(voc)
-    vocabs.sort(key=lambda v: v.title)
-    total = len(g.VOCABS.items())
+    # the vocabs in title order, or those with the facet values asked for, from the register index
+    register = registry.register
+    facet_filters = {facet: request.values.get(facet) for facet in register.FACETS if request.values.get(facet)}
+    vocabs = register.select(facet_filters)
 
-    # Search
+    # Search, best match first
     query = request.values.get('search')
-    results = []
     if query:
-        for m in match(vocabs, query):
-            results.append(m)
-        vocabs[:] = results
-        vocabs.sort(key=lambda v: v.title)
-        total = len(vocabs)
+        selected = set(vocab.id for vocab in vocabs) if facet_filters else None
+        vocabs = [vocab for vocab in search_index.search_vocabs(query) if selected is None or vocab.id in selected]
+    total = len(vocabs)
 
     # generate vocabs list for requested page and per_page
     start = (page-1)*per_page
@@ -140,7 +137,11 @@ def vocabularies():
         total,
         search_query=query,
         search_enabled=True,
-        vocabulary_url=['http://www.w3.org/2004/02/skos/core#ConceptScheme']
+        vocabulary_url=['http://www.w3.org/2004/02/skos/core#ConceptScheme'],
+        facets=register.facet_counts,
+        facet_filters=facet_filters,
+        # the query string arguments kept by the facet links, which go back to the first page
+        facet_args={arg: value for arg, value in request.args.items() if arg != 'page'}
     ).render()
 
 
@@ -163,6 +164,188 @@ def vocabulary(vocab_id):
     ).render()
 
 
+@routes.route('/vocabulary/<vocab_id>/narrowers')
+def vocabulary_narrowers(vocab_id):
+    """
+    Lists the narrowers of a concept in a vocab's concept hierarchy, or its top concepts if no 'uri' query string
+    argument is given, with the number of narrowers each of them has, for expanding the hierarchy on demand
+
+    :return: A JSON response
+    :rtype: :class:`flask.Response`
+    """
+    language = request.values.get('lang') or config.DEFAULT_LANGUAGE
+    uri = request.values.get('uri')
+
+    if vocab_id not in g.VOCABS.keys():
+        return render_invalid_vocab_id_response()
+
+    narrowers = Source(vocab_id, request, language).get_concept_narrowers(uri)
+    return jsonify({
+        'uri': uri,
+        'narrowers': [
+            {'uri': concept, 'label': preflabel, 'narrowers': count,
+             'link': Source.get_object_url(request, vocab_id, concept)}
+            for concept, preflabel, count in narrowers
+        ]
+    })
+
+
+@routes.route('/vocabulary/<vocab_id>/closure')
+def vocabulary_closure(vocab_id):
+    """
+    Answers transitive broader/narrower questions about the concept given by the 'uri' query string argument from
+    the vocab's concept hierarchy: its ancestors, the path to it from its top concept, all the concepts under it and,
+    if an 'under' argument is given, whether it is under that concept
+
+    :return: A JSON response
+    :rtype: :class:`flask.Response`
+    """
+    language = request.values.get('lang') or config.DEFAULT_LANGUAGE
+    uri = request.values.get('uri')
+    under = request.values.get('under')
+
+    if vocab_id not in g.VOCABS.keys():
+        return render_invalid_vocab_id_response()
+
+    if uri is None:
+        return Response(
+            'A Query String Argument \'uri\' must be supplied for this endpoint, '
+            'indicating a concept within the vocabulary',
+            status=400,
+            mimetype='text/plain'
+        )
+
+    closure = Source(vocab_id, request, language).get_concept_closure()
+    if uri not in closure:
+        return Response(
+            'The concept {} is not in the concept hierarchy of vocabulary {}'.format(uri, vocab_id),
+            status=404,
+            mimetype='text/plain'
+        )
+
+    def concepts(uris):
+        # a broader concept that the hierarchy doesn't list itself has no label
+        return [{'uri': concept, 'label': closure.labels.get(concept)} for concept in uris]
+
+    content = {
+        'uri': uri,
+        'label': closure.labels[uri],
+        'path': concepts(closure.path(uri)),
+        'ancestors': concepts(closure.ancestors(uri)),
+        'descendants': concepts(closure.descendants(uri)),
+    }
+    if under is not None:
+        content['under'] = under
+        content['is_under'] = closure.is_under(uri, under)
+    return jsonify(content)
+
+
+@routes.route('/vocabulary/<vocab_id>/purge', methods=['POST'])
+def vocabulary_purge(vocab_id):
+    """
+    Drops a vocab's cached concept hierarchies, memoised query results, concept labels and search indexes, in every
+    worker process, so they are rebuilt, e.g. after the vocab has been changed without its modified date or versionInfo
+    changing. The request must have an 'Authorization: Bearer <PURGE_TOKEN>' header; without a PURGE_TOKEN configured,
+    purging is disabled.
+
+    :return: A JSON response
+    :rtype: :class:`flask.Response`
+    """
+    token = getattr(config, 'PURGE_TOKEN', None)
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+        return jsonify({'error': 'A valid purge token is required'}), 403
+
+    if vocab_id not in g.VOCABS.keys():
+        return jsonify({'error': 'Unknown vocab_id {}'.format(vocab_id)}), 404
+
+    Source.purge(vocab_id)
+    search_index.invalidate(vocab_id)
+    return jsonify({'vocab_id': vocab_id, 'purged': True})
+
+
+@routes.route('/vocabulary/<vocab_id>/autocomplete')
+def vocabulary_autocomplete(vocab_id):
+    """
+    Lists the concepts of a vocab with a label that starts with the 'search' query string argument, or has a word that
+    does, for typeahead: at most 'limit' of them (AUTOCOMPLETE_LIMIT by default), prefLabels before altLabels and
+    hiddenLabels and whole labels before later words, each in label order. While the vocab's concepts are being
+    indexed, which is started here if need be, the response is a 503 with a Retry-After header
+
+    :return: A JSON response
+    :rtype: :class:`flask.Response`
+    """
+    language = request.values.get('lang') or config.DEFAULT_LANGUAGE
+    query = request.values.get('search')
+    limit = int(request.values.get('limit')) if request.values.get('limit') is not None \
+        else getattr(config, 'AUTOCOMPLETE_LIMIT', 10)
+    limit = min(max(limit, 1), getattr(config, 'MAX_PER_PAGE', 100))
+
+    if vocab_id not in g.VOCABS.keys():
+        return render_invalid_vocab_id_response()
+
+    if not query:
+        return Response(
+            'A Query String Argument \'search\' must be supplied for this endpoint, giving the text to complete',
+            status=400,
+            mimetype='text/plain'
+        )
+
+    completions = search_index.complete(vocab_id, query, limit, language, wait=False)
+    if completions is None:
+        return Response(
+            'The concepts of vocabulary {} are not available for autocompletion yet'.format(vocab_id),
+            status=503,
+            mimetype='text/plain',
+            headers={'Retry-After': str(getattr(config, 'AUTOCOMPLETE_RETRY_SECONDS', 5))}
+        )
+
+    return jsonify({
+        'search': query,
+        'results': [
+            {'uri': concept['uri'], 'label': label, 'title': concept['title']}
+            for concept, label in completions
+        ]
+    })
+
+
+@routes.route('/vocabulary/<vocab_id>/export')
+def vocabulary_export(vocab_id):
+    """
+    Streams all the concepts of a vocab, in the format given by the 'format' query string argument: 'csv' (the
+    default) or 'jsonl' for the URI, prefLabel, definition and dates of each concept, or 'nt' for all the triples about
+    the concepts as N-Triples, leaving out those with blank nodes
+
+    :return: A streamed Flask Response object, or a 502 response if the vocab's source couldn't be queried
+    :rtype: :class:`flask.Response`
+    """
+    language = request.values.get('lang') or config.DEFAULT_LANGUAGE
+    export_format = request.values.get('format') or 'csv'
+
+    if vocab_id not in g.VOCABS.keys():
+        return render_invalid_vocab_id_response()
+
+    if export_format not in Source.EXPORT_FORMATS:
+        return Response(
+            'The Query String Argument \'format\' must be one of {}'.format(', '.join(Source.EXPORT_FORMATS)),
+            status=400,
+            mimetype='text/plain'
+        )
+
+    lines = Source(vocab_id, request, language).export_concepts(export_format)
+    if lines is None:
+        return Response(
+            'Unable to query the concepts of vocab {}'.format(vocab_id),
+            status=502,
+            mimetype='text/plain'
+        )
+
+    return Response(
+        stream_with_context(lines),
+        mimetype=Source.EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': 'attachment; filename="{}.{}"'.format(vocab_id, export_format)}
+    )
+
+
 @routes.route('/vocabulary/<vocab_id>/concept/')
 def vocabulary_list(vocab_id):
     language = request.values.get('lang') or config.DEFAULT_LANGUAGE
@@ -170,26 +353,30 @@ def vocabulary_list(vocab_id):
     if vocab_id not in g.VOCABS.keys():
         return render_invalid_vocab_id_response()
     
-    vocab_source = Source(vocab_id, request, language)
-    concepts = vocab_source.list_concepts()
-    concepts.sort(key=lambda x: x['title'])
-    total = len(concepts)
+    page, per_page = get_page_args()
+    start = (page - 1) * per_page
 
-    # Search
+    # Search, best match first, from the vocab's concept index in this language. Until it has been built, which is
+    # started here if need be, all the concepts are listed instead, with a notice that search isn't available yet
     query = request.values.get('search')
-    results = []
+    concepts = None
+    search_indexing = False
     if query:
-        for m in match(concepts, query):
-            results.append(m)
-        concepts[:] = results
-        concepts.sort(key=lambda x: x['title'])
-        total = len(concepts)
+        concepts = search_index.search_concepts(vocab_id, query, language, wait=False)
+        search_indexing = concepts is None
 
-    page = int(request.values.get('page')) if request.values.get('page') is not None else 1
-    per_page = int(request.values.get('per_page')) if request.values.get('per_page') is not None else 20
-    start = (page - 1) * per_page
-    end = start + per_page
-    concepts = concepts[start:end]
+    if concepts is None:
+        # the concepts in this language from the vocab's labels in all languages, if they have been loaded
+        label_store = search_index.label_store(vocab_id, wait=False)
+        if label_store is not None:
+            concepts = label_store.concepts(language)
+
+    if concepts is not None:
+        total = len(concepts)
+        concepts = concepts[start:start + per_page]
+    else:
+        # only the page of concepts is queried for, and counted by the triplestore
+        concepts, total = Source(vocab_id, request, language).list_concepts_page(per_page, start)
 
     test = SkosRegisterRenderer(
         request,
@@ -200,11 +387,48 @@ def vocabulary_list(vocab_id):
         search_query=query,
         search_enabled=True,
         vocabulary_url=[request.url_root + 'vocabulary/' + vocab_id],
-        vocab_id=vocab_id
+        vocab_id=vocab_id,
+        search_indexing=search_indexing
     )
     return test.render()
 
 
+@routes.route('/search')
+def search():
+    """
+    Searches the labels of the concepts of all the vocabs at once, for the 'search' query string argument, paged by the
+    'page' and 'per_page' arguments. Vocabs whose concepts are still being indexed are left out, and counted in
+    'indexing'.
+
+    :return: A JSON response
+    :rtype: :class:`flask.Response`
+    """
+    query = request.values.get('search')
+    page, per_page = get_page_args()
+
+    if not query:
+        return Response(
+            'A Query String Argument \'search\' must be supplied for this endpoint, giving the text to search for',
+            status=400,
+            mimetype='text/plain'
+        )
+
+    results = search_index.search_all(query)
+    start = (page - 1) * per_page
+    return jsonify({
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'total': len(results),
+        'indexing': search_index.status()['building'],
+        'results': [
+            {'uri': concept['uri'], 'vocab_id': concept['key'], 'label': label, 'title': concept['title'],
+             'link': Source.get_object_url(request, concept['key'], concept['uri'])}
+            for concept, label, _score in results[start:start + per_page]
+        ]
+    })
+
+
 @routes.route('/collection/')
 def collections():
     return render_template(
@@ -255,12 +479,13 @@ def object():
     vocab_source = Source(vocab_id, request, language)
 
     try:
-        # TODO reuse object within if, rather than re-loading graph
-        c = vocab_source.get_object_class()
+        # one query gets the object's class along with all of the properties needed to render a Concept
+        object_properties = vocab_source.get_object_properties()
+        c = vocab_source.get_object_class(object_properties)
         #print(c)
 
         if c == 'http://www.w3.org/2004/02/skos/core#Concept':
-            concept = vocab_source.get_concept()
+            concept = vocab_source.get_concept(object_properties)
             return ConceptRenderer(
                 request,
                 concept
@@ -316,6 +541,24 @@ def about():
     )
 
 
+@routes.route('/status')
+def status():
+    """
+    Reports the state of this worker process's vocab index, including when it was last refreshed and how long that
+    took, and of its cache store, for monitoring
+
+    :return: A Flask Response object containing JSON
+    :rtype: :class:`flask.Response`
+    """
+    return jsonify({
+        'registry': registry.status(),
+        'cache': h.cache_store.stats(),
+        'sparql_query_cache': Source.query_cache.stats(),
+        'http_pools': http_pool.stats(),
+        'search_index': search_index.status()
+    })
+
+
 # the SPARQL UI
 @routes.route('/sparql', methods=['GET', 'POST'])
 def sparql():
@@ -1,9 +1,9 @@
-import requests
 import io
 from rdflib import Graph
 from pyldapi import Renderer
 import _config as config
 import logging
+from data.http_pool import http_pool
 
 
 def get_sparql_service_description(rdf_format='turtle'):
@@ -58,7 +58,7 @@ def sparql_query(query, format_mimetype='application/json'):
         
     try:
         logging.debug('endpoint={}\ndata={}\nheaders={}'.format(config.SPARQL_ENDPOINT, data, headers))
-        r = requests.post(config.SPARQL_ENDPOINT, auth=auth, data=data, headers=headers, timeout=60)
+        r = http_pool.post(config.SPARQL_ENDPOINT, auth=auth, data=data, headers=headers, timeout=60)
         logging.debug('response: {}'.format(r.__dict__))
         return r.content.decode('utf-8')
     except Exception as e:
@@ -0,0 +1,321 @@
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import fcntl  # cross-process file locking, POSIX only
+except ImportError:
+    fcntl = None
+
+
+class CacheStore:
+    """
+    Interface for a store of pickled Python objects, keyed by name (e.g. 'VOCAB_SOURCES.p')
+
+    Implementations keep the total size of their stored objects within max_bytes by evicting the least recently used
+    ones and count hits and misses. Objects that fail to unpickle are treated as misses and removed.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, max_age=None):
+        """
+        :param key: name of the object
+        :param max_age: seconds beyond which the object is treated as missing, or None to ignore its age
+        :return: the object or None if it is missing or too old
+        """
+        age = self.age(key)
+        value = None
+        if age is not None and (max_age is None or age <= max_age):
+            data = self._read(key)
+            if data is not None:
+                try:
+                    value = pickle.loads(data)
+                except Exception as e:
+                    logging.debug('Unable to unpickle cached {}: {}'.format(key, e))
+                    self.delete(key)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Stores an object, replacing any existing one of the same key, then evicts least recently used objects until
+        the store is within max_bytes
+        """
+        self._write(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def age(self, key):
+        """
+        :return: seconds since the object was stored or None if there is no such object
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def size(self):
+        """
+        :return: total bytes of all stored objects
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            'backend': self.__class__.__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes': self.size(),
+            'max_bytes': self.max_bytes,
+        }
+
+    def _read(self, key):
+        raise NotImplementedError
+
+    def _write(self, key, data):
+        raise NotImplementedError
+
+
+class MemoryCacheStore(CacheStore):
+    """
+    Cache store held in this process's memory
+    """
+
+    def __init__(self, max_bytes=None):
+        super().__init__(max_bytes)
+        self._items = OrderedDict()  # key -> (pickled bytes, time stored), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def age(self, key):
+        item = self._items.get(key)
+        return time.time() - item[1] if item is not None else None
+
+    def delete(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._bytes -= len(item[0])
+
+    def size(self):
+        return self._bytes
+
+    def _read(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def _write(self, key, data):
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._items[key] = (data, time.time())
+            self._bytes += len(data)
+
+            while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._items) > 1:
+                _key, (evicted, _stored) = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+                logging.debug('Evicted {} from memory cache'.format(_key))
+
+
+class DiskCacheStore(CacheStore):
+    """
+    Cache store of one file per object in a directory that may be shared by several worker processes
+
+    Files are written to a temporary file and renamed into place, so readers never see a partial file, and writers and
+    evictions hold an exclusive lock on the directory's lock file. A file's modification time is when it was stored and
+    its access time, set explicitly on every read, when it was last used.
+    """
+    LOCK_FILE_NAME = '.lock'
+
+    def __init__(self, directory, max_bytes=None):
+        super().__init__(max_bytes)
+        self.directory = directory
+        self._lock = threading.Lock()  # flock() doesn't exclude threads sharing one open file, so this does
+
+    def age(self, key):
+        try:
+            return time.time() - os.stat(self._path(key)).st_mtime
+        except OSError:
+            return None
+
+    def delete(self, key):
+        with self._locked():
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def size(self):
+        return sum(size for _path, size, _atime in self._files())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _files(self):
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return files
+        for entry in entries:
+            if entry.name == self.LOCK_FILE_NAME or entry.name.startswith('.tmp') or not entry.is_file():
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue  # removed by another process
+            files.append((entry.path, st.st_size, st.st_atime))
+        return files
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))  # mark as recently used without changing its age
+            return data
+        except OSError:
+            return None
+
+    def _write(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked():
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self._path(key))
+            except Exception:
+                os.remove(tmp_path)
+                raise
+            logging.debug('Cache file {} written'.format(self._path(key)))
+            self._evict(keep=self._path(key))
+
+    def _evict(self, keep):
+        if self.max_bytes is None:
+            return
+        files = self._files()
+        total = sum(size for _path, size, _atime in files)
+        for path, size, _atime in sorted(files, key=lambda f: f[2]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+                logging.debug('Evicted cache file {}'.format(path))
+            except OSError:
+                pass
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds this store's thread lock and an exclusive flock() on the directory's lock file
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, self.LOCK_FILE_NAME), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+                yield
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory map of at most max_entries objects, each expiring ttl seconds after it was set, with the least
+    recently used evicted first. Entries may be tagged (e.g. with a vocab_id) so that all those with the same tag can be
+    invalidated together.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items = OrderedDict()  # key -> (value, expiry time, tag), least recently used first
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        :return: the object or None if it is missing or has expired
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] < time.time():
+                self._remove(key)
+                item = None
+
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, tag=None):
+        if not self.ttl or not self.max_entries:
+            return
+        with self._lock:
+            self._remove(key)
+            self._items[key] = (value, time.time() + self.ttl, tag)
+            self._tags.setdefault(tag, set()).add(key)
+            while len(self._items) > self.max_entries:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def invalidate(self, tag=None):
+        """
+        Removes all the entries with the given tag or, if no tag is given, all entries
+        """
+        with self._lock:
+            if tag is None:
+                self._items.clear()
+                self._tags.clear()
+            else:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def stats(self):
+        return {
+            'entries': len(self._items),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _remove(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            keys = self._tags.get(item[2])
+            keys.discard(key)
+            if not keys:
+                del self._tags[item[2]]
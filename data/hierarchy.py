@@ -0,0 +1,241 @@
+from html import escape
+from collections import OrderedDict
+
+
+def build_hierarchy(bindings_list):
+    """
+    Builds a concept hierarchy list from the bindings of a concept hierarchy query, i.e. dicts with 'concept',
+    'concept_preflabel' and, for a concept that has one, 'broader_concept' bindings
+
+    The broader/narrower edges are indexed once and the tree is then walked depth-first with an explicit stack, so the
+    time taken grows with the number of bindings (plus sorting each concept's narrowers by prefLabel) and deep
+    vocabularies can't exceed the recursion limit. A concept with several broaders appears under each of them
+    (polyhierarchy). A concept that is its own ancestor is not descended into again, so cycles end the branch rather than
+    looping forever.
+
+    :param bindings_list: SPARQL result bindings
+    :type bindings_list: list
+    :return: (<level>, <concept>, <concept_preflabel>, <broader_concept>) tuples in display order, level 1 being the
+    top concepts
+    :rtype: list
+    """
+    # broader concept, or None for top concepts -> {narrower concept: prefLabel}, each pair once
+    narrowers = {}
+    for binding_dict in bindings_list:
+        broader = binding_dict['broader_concept']['value'] if binding_dict.get('broader_concept') else None
+        children = narrowers.get(broader)
+        if children is None:
+            children = narrowers[broader] = OrderedDict()
+        children.setdefault(binding_dict['concept']['value'], binding_dict['concept_preflabel']['value'])
+
+    def sorted_narrowers(broader):
+        children = narrowers.get(broader)
+        if not children:
+            return []
+        return sorted(children.items(), key=lambda child: child[1])
+
+    hierarchy = []
+    path = []  # the concepts on the branch currently being walked, top concept first
+    on_path = set()
+    # each stack entry is (level, broader concept, iterator over its remaining (narrower, prefLabel) pairs)
+    stack = [(1, None, iter(sorted_narrowers(None)))]
+    while stack:
+        level, broader, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if broader is not None:
+                on_path.discard(path.pop())
+            continue
+
+        concept, preflabel = child
+        if concept in on_path:
+            continue  # a cycle back to an ancestor
+        hierarchy.append((level, concept, preflabel, broader))
+        path.append(concept)
+        on_path.add(concept)
+        stack.append((level + 1, concept, iter(sorted_narrowers(concept))))
+
+    return hierarchy
+
+
+def render_hierarchy_html(hierarchy, concept_url):
+    """
+    Renders a concept hierarchy list straight to the nested HTML lists shown on vocabulary pages, in a single pass
+
+    A concept with narrowers has its link wrapped in a <span class="caret"> and its narrowers in a <ul class="nested">
+    that immediately follows it, for the concept_hierarchy.html macro's expand/collapse script. Levels that jump by more
+    than one, as the FILE and VocBench sources' path-length queries can give, are attached under the concept's broader
+    concept if it has already been listed, or else at the top level.
+
+    :param hierarchy: (<level>, <concept>, <concept_preflabel>, <broader_concept>) tuples in display order
+    :type hierarchy: list
+    :param concept_url: function giving the link for a concept URI
+    :type concept_url: function
+    :return: the HTML, or an empty string for an empty hierarchy
+    :rtype: str
+    """
+    depths = {}  # concept -> depth at which it was last listed, 0 being the top level
+    items = []  # (depth, concept, prefLabel)
+    previous_depth = -1
+    for level, concept, preflabel, broader in hierarchy:
+        if level > previous_depth + 2:
+            depth = depths[broader] + 1 if broader in depths else 0
+        elif broader not in depths:
+            depth = 0
+        else:
+            depth = level - 1
+        depth = max(0, min(depth, previous_depth + 1))  # a list can only be opened one level deeper at a time
+        depths[concept] = depth
+        items.append((depth, concept, preflabel))
+        previous_depth = depth
+
+    if not items:
+        return ''
+
+    html = ['<ul>']
+    for i, (depth, concept, preflabel) in enumerate(items):
+        next_depth = items[i + 1][0] if i + 1 < len(items) else 0
+        link = '<a href="{}">{}</a>'.format(escape(concept_url(concept), quote=True), escape(preflabel, quote=False))
+        if next_depth > depth:
+            html.append('<li><span class="caret">{}</span><ul class="nested">'.format(link))
+        else:
+            html.append('<li>{}</li>'.format(link))
+            html.append('</ul></li>' * (depth - next_depth))
+    html.append('</ul>')
+    return '\n'.join(html)
+
+
+def hierarchy_narrowers(hierarchy):
+    """
+    Indexes a concept hierarchy list by broader concept, for looking up a concept's narrowers without walking the tree
+
+    :param hierarchy: (<level>, <concept>, <concept_preflabel>, <broader_concept>) tuples in display order
+    :type hierarchy: list
+    :return: broader concept, or None for the top concepts -> {narrower concept: prefLabel} in display order
+    :rtype: dict
+    """
+    narrowers = {}
+    for _level, concept, preflabel, broader in hierarchy:
+        children = narrowers.get(broader)
+        if children is None:
+            children = narrowers[broader] = OrderedDict()
+        children.setdefault(concept, preflabel)
+    return narrowers
+
+
+def render_lazy_hierarchy_html(top_concepts, has_narrowers, concept_url, narrowers_url):
+    """
+    Renders only the top level of a concept hierarchy, for one too large to send whole. A concept with narrowers has its
+    link wrapped in a <span class="caret"> whose data-narrowers attribute is the URL from which the concept_hierarchy.html
+    macro's script fetches them, and is followed by an empty <ul class="nested"> for them.
+
+    :param top_concepts: (<concept>, <concept_preflabel>) pairs of the top concepts in display order
+    :type top_concepts: iterable
+    :param has_narrowers: function telling whether a concept URI has narrowers
+    :type has_narrowers: function
+    :param concept_url: function giving the link for a concept URI
+    :type concept_url: function
+    :param narrowers_url: function giving the URL of the JSON list of a concept's narrowers
+    :type narrowers_url: function
+    :return: the HTML, or an empty string for an empty hierarchy
+    :rtype: str
+    """
+    html = ['<ul>']
+    for concept, preflabel in top_concepts:
+        link = '<a href="{}">{}</a>'.format(escape(concept_url(concept), quote=True), escape(preflabel, quote=False))
+        if has_narrowers(concept):
+            html.append('<li><span class="caret" data-narrowers="{}">{}</span><ul class="nested"></ul></li>'.format(
+                escape(narrowers_url(concept), quote=True), link))
+        else:
+            html.append('<li>{}</li>'.format(link))
+    if len(html) == 1:
+        return ''
+    html.append('</ul>')
+    return '\n'.join(html)
+
+
+class HierarchyClosure:
+    """
+    Transitive closure of the broader/narrower relations of a concept hierarchy, built from a concept hierarchy list so
+    that "is X under Y", "ancestors of X" and "subtree of Y" are answered by lookups rather than by property path queries
+
+    The relations are taken from the list's broader_concept column rather than from its levels, as the levels of the
+    FILE and VocBench sources' path-length queries can jump by more than one. A concept listed under several broaders
+    (polyhierarchy) has the ancestors from all of them, and is in the subtree of each. A cycle of broaders doesn't make
+    a concept its own ancestor.
+    """
+
+    def __init__(self, hierarchy):
+        """
+        :param hierarchy: (<level>, <concept>, <concept_preflabel>, <broader_concept>) tuples in display order
+        :type hierarchy: list
+        """
+        self._order = {}  # concept -> position at which it was first seen, as a concept or a broader, for display order
+        self._broaders = OrderedDict()  # concept -> its broader concepts, in display order
+        self._narrowers = {}  # broader concept -> its narrower concepts, in display order
+        self._first_broaders = {}  # concept -> its broader concept at its first listing, None for a top concept
+        self.labels = {}  # concept -> prefLabel
+
+        for _level, concept, preflabel, broader in hierarchy:
+            self._order.setdefault(concept, len(self._order))
+            broaders = self._broaders.setdefault(concept, OrderedDict())
+            if concept not in self.labels:
+                self.labels[concept] = preflabel
+                self._first_broaders[concept] = broader
+            if broader is not None and broader not in broaders:
+                self._order.setdefault(broader, len(self._order))
+                broaders[broader] = None
+                self._narrowers.setdefault(broader, []).append(concept)
+
+        self._ancestors = {}  # concept -> set of all the concepts it is under
+        for concept in self._broaders:
+            self._ancestors[concept] = self._walk(concept, self._broaders)
+
+    def _walk(self, concept, relations):
+        # the concepts reached from concept by following relations any number of times, other than concept itself
+        reached = set()
+        stack = [concept]
+        while stack:
+            for related in relations.get(stack.pop(), ()):
+                if related not in reached and related != concept:
+                    reached.add(related)
+                    stack.append(related)
+        return reached
+
+    def __contains__(self, concept):
+        return concept in self.labels
+
+    def is_under(self, concept, broader):
+        """
+        :return: True if concept is a narrower of broader, at any depth
+        :rtype: bool
+        """
+        return broader in self._ancestors.get(concept, ())
+
+    def ancestors(self, concept):
+        """
+        :return: all the concepts that concept is under, in display order
+        :rtype: list
+        """
+        return sorted(self._ancestors.get(concept, ()), key=self._order.get)
+
+    def path(self, concept):
+        """
+        :return: the concepts from a top concept down to concept's parent, through the broader concept of each at its
+        first listing, e.g. for breadcrumbs
+        :rtype: list
+        """
+        path = []
+        broader = self._first_broaders.get(concept)
+        while broader is not None and broader != concept and broader not in path:
+            path.append(broader)
+            broader = self._first_broaders.get(broader)
+        return path[::-1]
+
+    def descendants(self, concept):
+        """
+        :return: all the concepts under concept, in display order, each once
+        :rtype: list
+        """
+        return sorted(self._walk(concept, self._narrowers), key=self._order.get)
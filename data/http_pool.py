@@ -0,0 +1,256 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import _config as config
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of making a request to an endpoint whose circuit breaker is open
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one endpoint. After failure_threshold consecutive failures the breaker opens and requests fail
+    fast for reset_seconds. It then lets a single trial request through (half-open): if that succeeds the breaker
+    closes, otherwise it opens again. A trial that hasn't reported back after another reset_seconds is replaced by the
+    next request.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CircuitBreaker.CLOSED
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self.opened_at = None
+        self.trial_at = None  # when the half-open trial request was let through
+        self._lock = threading.Lock()
+
+    def before_request(self, endpoint):
+        """
+        :raises CircuitOpenError: if the request must not be made
+        """
+        with self._lock:
+            if self.state == CircuitBreaker.OPEN and time.time() - self.opened_at >= self.reset_seconds:
+                self.state = CircuitBreaker.HALF_OPEN  # this request is the trial
+                self.trial_at = time.time()
+                return
+            if self.state == CircuitBreaker.HALF_OPEN and time.time() - self.trial_at >= self.reset_seconds:
+                self.trial_at = time.time()  # the last trial never reported back, so let this one be the trial
+                return
+            if self.state != CircuitBreaker.CLOSED:
+                self.rejected += 1
+                raise CircuitOpenError('Circuit breaker for {} is {}'.format(endpoint, self.state))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CircuitBreaker.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self, endpoint):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or \
+                    (self.state == CircuitBreaker.CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.time()
+                self.times_opened += 1
+                logging.error('Circuit breaker for {} opened after {} consecutive failures'.format(
+                    endpoint, self.consecutive_failures))
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected,
+        }
+
+
+class HttpPool:
+    """
+    Shared, keep-alive HTTP clients for upstream services, one requests Session per endpoint (scheme, host & port)
+
+    Each endpoint's Session keeps up to HTTP_POOL_SIZE connections open for reuse, or the size given for that endpoint
+    in HTTP_POOL_SIZES, so repeated queries don't each pay for a new TCP and TLS handshake. Requests through the pool are
+    counted per endpoint for monitoring.
+
+    Requests that fail to connect, time out or get a 5xx or 429 response are retried up to MAX_RETRIES times, after a
+    random delay of up to RETRY_BACKOFF_SECONDS * 2^attempt, capped at RETRY_BACKOFF_MAX_SECONDS (exponential backoff
+    with full jitter). The waits before the retries of one request add up to no more than RETRY_MAX_WAIT_SECONDS, so a
+    request thread isn't held up for long by an endpoint that is flaky; a retry whose wait would go over that isn't
+    made. Each endpoint also has a CircuitBreaker, so that while an endpoint is known to be down requests to
+    it fail at once rather than tying up worker threads.
+    """
+
+    def __init__(self, pool_size=10, pool_sizes=None, max_retries=2, backoff_seconds=0.5, backoff_max_seconds=5,
+                 max_wait_seconds=2, breaker_failures=5, breaker_reset_seconds=30):
+        self.pool_size = pool_size
+        self.pool_sizes = pool_sizes or {}
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self._sessions = {}
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        """
+        :param url: any URL at the endpoint
+        :return: the endpoint's shared Session
+        :rtype: requests.Session
+        """
+        endpoint = HttpPool._endpoint(url)
+        session = self._sessions.get(endpoint)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(endpoint)
+                if session is None:
+                    pool_size = self.pool_sizes.get(endpoint, self.pool_size)
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._sessions[endpoint] = session
+                    self._breakers[endpoint] = CircuitBreaker(self.breaker_failures, self.breaker_reset_seconds)
+                    self._stats[endpoint] = {
+                        'pool_size': pool_size,
+                        'requests': 0,
+                        'retries': 0,
+                        'errors': 0,
+                        'in_flight': 0,
+                        'max_in_flight': 0,
+                    }
+                    logging.debug('Created HTTP pool of {} connections for {}'.format(pool_size, endpoint))
+        return session
+
+    def request(self, method, url, max_retries=None, **kwargs):
+        """
+        Makes a request using the endpoint's shared Session, retrying and circuit breaking as described above. Takes the
+        same arguments as requests.request(), plus max_retries to override MAX_RETRIES
+        :return: the response, which may still be an error response if the retries ran out
+        :rtype: requests.Response
+        :raises CircuitOpenError: if the endpoint's circuit breaker is open
+        """
+        session = self.session(url)
+        endpoint = HttpPool._endpoint(url)
+        breaker = self._breakers[endpoint]
+        stats = self._stats[endpoint]
+        max_retries = self.max_retries if max_retries is None else max_retries
+
+        attempt = 0
+        waited = 0
+        while True:
+            breaker.before_request(endpoint)
+            response = None
+            with self._lock:
+                stats['requests'] += 1
+                stats['in_flight'] += 1
+                stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+            try:
+                response = session.request(method, url, **kwargs)
+                error = None
+            except requests.RequestException as e:
+                error = e
+            except Exception:
+                # not a failure to retry, but the breaker must still hear how a trial request went
+                breaker.record_failure(endpoint)
+                with self._lock:
+                    stats['errors'] += 1
+                raise
+            finally:
+                with self._lock:
+                    stats['in_flight'] -= 1
+
+            if error is None and response.status_code < 500 and response.status_code != 429:
+                breaker.record_success()
+                return response
+
+            breaker.record_failure(endpoint)
+            with self._lock:
+                stats['errors'] += 1
+            delay = self.backoff_delay(attempt)
+            if attempt >= max_retries or waited + delay > self.max_wait_seconds:
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            waited += delay
+            with self._lock:
+                stats['retries'] += 1
+            logging.warning('Request to {} failed ({}), retry {} of {} in {:.2f} seconds'.format(
+                url, error or response.status_code, attempt, max_retries, delay))
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt):
+        """
+        :param attempt: number of retries already made
+        :return: seconds to wait before the next retry
+        :rtype: float
+        """
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """
+        :return: request counts, connection pool usage and circuit breaker state for each endpoint
+        :rtype: dict
+        """
+        stats = {}
+        for endpoint, session in list(self._sessions.items()):
+            stats[endpoint] = dict(self._stats[endpoint])
+            stats[endpoint].update(HttpPool._connection_stats(session))
+            stats[endpoint]['circuit_breaker'] = self._breakers[endpoint].stats()
+        return stats
+
+    @staticmethod
+    def _connection_stats(session):
+        # reads urllib3's connection pools, which requests doesn't expose, so tolerate them changing
+        opened = 0
+        idle = 0
+        try:
+            pools = session.get_adapter('http://').poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                opened += pool.num_connections
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        except Exception:
+            return {}
+        return {'connections_opened': opened, 'connections_idle': idle}
+
+    @staticmethod
+    def _endpoint(url):
+        parts = urlsplit(url)
+        return '{}://{}'.format(parts.scheme, parts.netloc)
+
+
+# the shared pool for this worker process
+http_pool = HttpPool(getattr(config, 'HTTP_POOL_SIZE', 10),
+                     getattr(config, 'HTTP_POOL_SIZES', None),
+                     max_retries=getattr(config, 'MAX_RETRIES', 2),
+                     backoff_seconds=getattr(config, 'RETRY_BACKOFF_SECONDS', 0.5),
+                     backoff_max_seconds=getattr(config, 'RETRY_BACKOFF_MAX_SECONDS', 5),
+                     max_wait_seconds=getattr(config, 'RETRY_MAX_WAIT_SECONDS', 2),
+                     breaker_failures=getattr(config, 'CIRCUIT_BREAKER_FAILURES', 5),
+                     breaker_reset_seconds=getattr(config, 'CIRCUIT_BREAKER_RESET_SECONDS', 30))
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import _config as config
+
+
+class LabelStore:
+    """
+    The labels and definitions of all of a vocab's concepts, in every language they have, fetched with one query so
+    that pages in any language are served from the same data rather than each language needing its own queries
+
+    A label is looked up in the languages of a fallback chain, in order: the language asked for, then those of
+    LABEL_FALLBACK_LANGUAGES, '' standing for labels with no language tag. The first language in which the concept has
+    that label is used.
+    """
+    FIELDS = ('prefLabel', 'altLabel', 'hiddenLabel', 'definition')
+
+    def __init__(self, vocab_id, concepts):
+        """
+        :param vocab_id: the vocab's ID
+        :type vocab_id: str
+        :param concepts: concept URI -> {'created': datetime, 'modified': datetime, <field>: {language: [value, ...]}},
+        language tags being lower-case and '' for no tag
+        :type concepts: dict
+        """
+        self.vocab_id = vocab_id
+        self._concepts = concepts
+        self._languages = set(language for fields in concepts.values() for field in LabelStore.FIELDS
+                              for language in fields.get(field, ()))
+        # label_language() -> list_concepts()-like dicts of the concepts with a prefLabel in its chain, in prefLabel order
+        self._sorted = {}
+
+    def __len__(self):
+        return len(self._concepts)
+
+    @staticmethod
+    def fallback_chain(language):
+        """
+        :return: the languages in which to look for a label asked for in language, in order
+        :rtype: tuple
+        """
+        chain = [language.lower() if language else '']
+        for fallback in getattr(config, 'LABEL_FALLBACK_LANGUAGES', [config.DEFAULT_LANGUAGE, '']):
+            if fallback.lower() not in chain:
+                chain.append(fallback.lower())
+        return tuple(chain)
+
+    def languages(self):
+        """
+        :return: all the language tags of the labels, '' for those without one
+        :rtype: list
+        """
+        return sorted(self._languages)
+
+    def label_language(self, language):
+        """
+        :return: the first language of language's fallback chain that there are labels in, whose fallback chain gives
+        the same labels as language's, so that the two can share a concept index or sorted list
+        :rtype: str
+        """
+        for chain_language in LabelStore.fallback_chain(language):
+            if chain_language in self._languages:
+                return chain_language
+        return language.lower() if language else ''
+
+    def get(self, uri, field, language):
+        """
+        :return: a concept's values of field in the first language of language's fallback chain that has any, or an
+        empty list
+        :rtype: list
+        """
+        values = self._concepts.get(uri, {}).get(field)
+        if values:
+            for chain_language in LabelStore.fallback_chain(language):
+                if values.get(chain_language):
+                    return values[chain_language]
+        return []
+
+    def concepts(self, language):
+        """
+        :return: the concepts that have a prefLabel in language's fallback chain, as list_concepts() gives them, in
+        prefLabel order; kept for each fallback chain, so a page of them is a slice
+        :rtype: list
+        """
+        concepts = self._sorted.get(self.label_language(language))
+        if concepts is None:
+            concepts = []
+            for uri, fields in self._concepts.items():
+                preflabels = self.get(uri, 'prefLabel', language)
+                if not preflabels:
+                    continue
+                definitions = self.get(uri, 'definition', language)
+                concepts.append({
+                    'key': self.vocab_id,
+                    'uri': uri,
+                    'title': preflabels[0],
+                    'definition': definitions[0] if definitions else None,
+                    'created': fields.get('created'),
+                    'modified': fields.get('modified')
+                })
+            concepts.sort(key=lambda concept: (concept['title'], concept['uri']))
+            self._sorted[self.label_language(language)] = concepts
+        return concepts
+
+    def documents(self, language):
+        """
+        :return: (concept, {field: [value, ...]}) pairs for a LabelIndex of the concepts in language, each field being
+        in the first language of its fallback chain that has it
+        :rtype: list
+        """
+        return [(concept, OrderedDict((field, self.get(concept['uri'], field, language)) for field in LabelStore.FIELDS))
+                for concept in self.concepts(language)]
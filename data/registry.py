@@ -0,0 +1,310 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from types import MappingProxyType
+import _config as config
+import data.source as source
+from data.source._source import Source
+from data.search import search_index
+import helper
+
+
+class RegisterIndex:
+    """
+    The vocabs of one version of the registry's index in title order, and grouped by each of FACETS, built once when
+    the index is swapped in so that the vocab register only has to slice out a page
+    """
+    FACETS = OrderedDict([
+        ('source', lambda vocab: vocab.data_source),
+        ('modified_year', lambda vocab: str(vocab.modified)[:4] if vocab.modified else None),
+    ])
+
+    def __init__(self, vocabs):
+        """
+        :param vocabs: Vocabulary objects, keyed by vocab_id
+        :type vocabs: dict
+        """
+        self.vocabs = tuple(sorted(vocabs.values(), key=lambda vocab: vocab.title))
+        self.facets = OrderedDict()  # facet -> value -> tuple of the vocabs with that value, in title order
+        for facet, value_of in self.FACETS.items():
+            groups = {}
+            for vocab in self.vocabs:
+                value = value_of(vocab)
+                if value is not None:
+                    groups.setdefault(value, []).append(vocab)
+            self.facets[facet] = OrderedDict((value, tuple(groups[value])) for value in sorted(groups))
+        # facet -> value -> the number of vocabs with that value
+        self.facet_counts = OrderedDict(
+            (facet, OrderedDict((value, len(vocabs)) for value, vocabs in groups.items()))
+            for facet, groups in self.facets.items()
+        )
+
+    def select(self, filters):
+        """
+        :param filters: facet -> value that the vocabs must have; facets that aren't in FACETS are ignored
+        :type filters: dict
+        :return: the vocabs with all the given facet values, in title order
+        :rtype: tuple
+        """
+        selections = [self.facets[facet].get(value, ()) for facet, value in filters.items() if facet in self.facets]
+        if not selections:
+            return self.vocabs
+        selections.sort(key=len)
+        vocabs = selections[0]
+        for selection in selections[1:]:
+            ids = set(vocab.id for vocab in selection)
+            vocabs = tuple(vocab for vocab in vocabs if vocab.id in ids)
+        return vocabs
+
+
+class VocabRegistry:
+    """
+    Process-wide index of all the vocabs from each of the vocab sources defined in config/__init__.py -> VOCAB_SOURCES
+
+    The index is loaded once per worker process, either from disk (VOCAB_SOURCES.p) or from a complete reload by calling
+    collect() for each of the vocab sources, and is then handed to every request as a read-only view. A refreshed index
+    is put in place by replacing that view in a single assignment, so a request sees either the old or the new index,
+    never a mixture of the two.
+
+    Once the index is older than VOCAB_CACHE_HOURS it is rebuilt by a background thread while requests carry on being
+    served from the previous index (stale-while-revalidate). Only a worker with no index at all blocks on collect().
+
+    The sources are collected concurrently and each must finish within VOCAB_SOURCE_TIMEOUT seconds. A source that
+    fails or runs out of time keeps the vocabs it had in the previous index, so it can't hold up or empty the others.
+    """
+    CACHE_FILE_NAME = 'VOCAB_SOURCES.p'  # the vocabs of each source, keyed by source name then vocab_id
+
+    def __init__(self):
+        self._vocabs = None
+        self._register = None  # (the index it was built from, its RegisterIndex)
+        self._source_vocabs = {}
+        self._collected_at = None  # epoch seconds when the current index was collected from the sources
+        self._lock = threading.RLock()  # re-entrant, as load() may start a refresh while holding it
+        self._refresh_thread = None
+        self.last_refresh = None  # datetime at which the last refresh finished
+        self.last_refresh_duration = None  # seconds taken by the last refresh
+        self.last_refresh_error = None
+        self.source_errors = {}  # source name -> error from that source's last collect(), if it failed
+
+    @property
+    def vocabs(self):
+        """
+        Read-only view of the vocab index, keyed by vocab_id. Loaded on first access and refreshed in the background
+        once stale.
+        :return: the current vocab index
+        :rtype: types.MappingProxyType
+        """
+        if self._vocabs is None:
+            with self._lock:
+                if self._vocabs is None:  # another thread may have loaded it while we waited for the lock
+                    self.load()
+        elif self.is_stale():
+            self.refresh_async()
+        return self._vocabs
+
+    @property
+    def register(self):
+        """
+        The current index's vocabs in title order and by facet, for the vocab register
+        :return: the RegisterIndex of the current index
+        :rtype: RegisterIndex
+        """
+        vocabs = self.vocabs
+        register = self._register
+        if register is None or register[0] is not vocabs:
+            # swap() builds it, so this is only for an index put in place some other way
+            register = self._register = (vocabs, RegisterIndex(vocabs))
+        return register[1]
+
+    def is_stale(self):
+        """
+        :return: True if the current index is older than VOCAB_CACHE_HOURS
+        :rtype: bool
+        """
+        return self._collected_at is None or time.time() - self._collected_at > config.VOCAB_CACHE_HOURS * 3600
+
+    def load(self):
+        """
+        Populates the index from VOCAB_SOURCES.p or, failing that, by calling collect() on each vocab source. An
+        out-of-date VOCAB_SOURCES.p is still used, but a background refresh is started straight away.
+        :return: nothing
+        """
+        cache_age = helper.cache_age(self.CACHE_FILE_NAME)
+        source_vocabs = helper.cache_read(self.CACHE_FILE_NAME, ignore_age=True) if cache_age is not None else None
+
+        if source_vocabs:
+            self.swap(source_vocabs, collected_at=time.time() - cache_age)
+            if self.is_stale():
+                self.refresh_async()
+        else:
+            # we haven't been able to load from VOCAB_SOURCES.p so run collect() on each vocab source to recreate it
+            self.refresh()
+
+    def refresh(self):
+        """
+        Rebuilds the index from the vocab sources and swaps it in, recording when this happened and how long it took.
+        If another worker process has already written a newer VOCAB_SOURCES.p, that is used instead of calling collect().
+        :return: nothing
+        """
+        start = time.time()
+        try:
+            cache_age = helper.cache_age(self.CACHE_FILE_NAME)
+            source_vocabs = None
+            if cache_age is not None and (self._collected_at is None or start - cache_age > self._collected_at):
+                source_vocabs = helper.cache_read(self.CACHE_FILE_NAME)
+            if source_vocabs:
+                collected_at = start - cache_age
+            else:
+                source_vocabs = self.collect()
+                collected_at = time.time()
+
+                # also load all vocabs into VOCAB_SOURCES.p on disk for future use
+                helper.cache_write(source_vocabs, self.CACHE_FILE_NAME)
+
+            self.swap(source_vocabs, collected_at=collected_at)
+            self.last_refresh_error = None
+        except Exception as e:
+            logging.error('Vocab index refresh failed: {}'.format(e))
+            self.last_refresh_error = str(e)
+            if self._vocabs is None:
+                raise
+            # keep serving the previous index, but don't try again until it is due once more
+            self._collected_at = time.time()
+        finally:
+            self.last_refresh = datetime.now()
+            self.last_refresh_duration = time.time() - start
+            logging.debug('Vocab index refresh took {:.2f} seconds'.format(self.last_refresh_duration))
+
+    def refresh_async(self):
+        """
+        Starts a background refresh of the index unless one is already running
+        :return: the refresh thread
+        :rtype: threading.Thread
+        """
+        with self._lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(target=self.refresh, name='vocab-registry-refresh', daemon=True)
+                self._refresh_thread.start()
+            return self._refresh_thread
+
+    def status(self):
+        """
+        Summary of the state of the index, for monitoring
+        :return: vocab count, index age and details of the last refresh
+        :rtype: dict
+        """
+        return {
+            'vocabs': len(self._vocabs) if self._vocabs is not None else 0,
+            'collected': datetime.fromtimestamp(self._collected_at).isoformat() if self._collected_at else None,
+            'refreshing': self._refresh_thread is not None and self._refresh_thread.is_alive(),
+            'last_refresh': self.last_refresh.isoformat() if self.last_refresh else None,
+            'last_refresh_duration': self.last_refresh_duration,
+            'last_refresh_error': self.last_refresh_error,
+            'sources': {
+                name: {
+                    'vocabs': len(self._source_vocabs.get(name) or {}),
+                    'error': self.source_errors.get(name),
+                }
+                for name in config.VOCAB_SOURCES
+            },
+        }
+
+    def collect(self):
+        """
+        Calls collect() on each of the vocab sources, using the appropriate class (from details['source']), in a pool
+        of VOCAB_SOURCE_WORKERS threads. A source that raises an exception, or whose collect() has been running for more
+        than VOCAB_SOURCE_TIMEOUT seconds, is given the vocabs it had in the current index instead. So that sources
+        queued behind ones that hang can't hold up the collection forever, any source not finished by the time that all
+        of them would have taken running their full VOCAB_SOURCE_TIMEOUT in turn is given its previous vocabs too,
+        whether it has started or not.
+        :return: the vocabs from each source, keyed by source name then vocab_id
+        :rtype: dict
+        """
+        timeout = getattr(config, 'VOCAB_SOURCE_TIMEOUT', 300)
+        workers = getattr(config, 'VOCAB_SOURCE_WORKERS', 4)
+        # as long as all the sources would take if each ran for its full timeout, as many at a time as there are workers
+        collect_timeout = timeout * -(-len(config.VOCAB_SOURCES) // workers)
+        deadline = time.time() + collect_timeout
+        started = {}  # source name -> time its collect() started, as sources may queue for a worker
+
+        def collect_source(name, details):
+            started[name] = time.time()
+            return getattr(source, details['source']).collect(details) or {}
+
+        source_vocabs = {}
+        source_errors = {}
+
+        def keep_previous(name, error):
+            logging.error('Unable to collect vocabs from source {}, keeping previous vocabs: {}'.format(name, error))
+            source_vocabs[name] = self._source_vocabs.get(name) or {}
+            source_errors[name] = error
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vocab-source')
+        futures = {executor.submit(collect_source, name, details): name
+                   for name, details in config.VOCAB_SOURCES.items()}
+        pending = set(futures)
+        while pending:
+            # wake up when a source finishes or the earliest running source, or the collection, is due to time out
+            deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started] + [deadline]
+            done, pending = wait(pending, timeout=max(0, min(deadlines) - time.time()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                try:
+                    source_vocabs[name] = future.result()
+                except Exception as e:
+                    keep_previous(name, str(e))
+
+            for future in list(pending):
+                name = futures[future]
+                if name in started and time.time() - started[name] > timeout:
+                    # the thread can't be stopped, but its result will be ignored
+                    keep_previous(name, 'Timed out after {} seconds'.format(timeout))
+                    pending.discard(future)
+                elif time.time() >= deadline:
+                    # still queued behind sources that haven't finished, or started too late to finish in time
+                    future.cancel()
+                    keep_previous(name, 'Not collected within {} seconds'.format(collect_timeout))
+                    pending.discard(future)
+        executor.shutdown(wait=False)
+
+        self.source_errors = source_errors
+        logging.debug('Collected {} vocabs from {} sources'.format(
+            sum(len(vocabs) for vocabs in source_vocabs.values()), len(source_vocabs)))
+        # keep the order of VOCAB_SOURCES, rather than that in which they finished, for predictable vocab_id clashes
+        return {name: source_vocabs[name] for name in config.VOCAB_SOURCES}
+
+    def swap(self, source_vocabs, collected_at=None):
+        """
+        Atomically replaces the index that requests see with the vocabs from all the given sources
+        :param source_vocabs: the vocabs from each source, keyed by source name then vocab_id
+        :type source_vocabs: dict
+        :param collected_at: epoch seconds at which the vocabs were collected from their sources, default now
+        :type collected_at: float
+        :return: nothing
+        """
+        vocabs = {}
+        for name in source_vocabs:
+            vocabs.update(source_vocabs[name])
+
+        # drop memoised query results for vocabs that have changed
+        if self._vocabs is not None:
+            for vocab_id, vocab in vocabs.items():
+                previous = self._vocabs.get(vocab_id)
+                if previous is not None and Source.vocab_version(previous) != Source.vocab_version(vocab):
+                    Source.invalidate(vocab_id)
+
+        self._source_vocabs = dict(source_vocabs)
+        view = MappingProxyType(vocabs)
+        self._register = (view, RegisterIndex(vocabs))
+        self._vocabs = view
+        self._collected_at = collected_at or time.time()
+
+        # index the vocabs for search, and the concepts of new and changed vocabs in the background
+        search_index.update(self._vocabs)
+
+
+# the one registry for this worker process
+registry = VocabRegistry()
@@ -0,0 +1,457 @@
+import heapq
+import logging
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+import _config as config
+from data.cache import TTLCache
+from data.labels import LabelStore
+from data.source._source import Source
+import helper
+
+
+def normalise(text):
+    """
+    :return: text lower-cased, with runs of anything but letters and digits collapsed to single spaces
+    :rtype: str
+    """
+    return ' '.join(LabelIndex.WORD.findall(str(text).lower()))
+
+
+class LabelIndex:
+    """
+    In-memory inverted index of the labels of a set of items, e.g. the concepts of a vocab, for substring search
+
+    Each item's labels are indexed by the character trigrams of their normalised text, so a search only has to check
+    the items that have the query's two rarest trigrams, rather than every item. A query shorter than a trigram checks
+    the items with any trigram containing it, labels shorter than a trigram being indexed whole. Matches are ranked by
+    the label's field (FIELD_WEIGHTS) and by how well it matched: the whole label, the start of it, the start of a word
+    in it or anywhere.
+
+    For autocompletion, the labels in PREFIX_FIELDS are also kept sorted, once from their start and once from each of
+    their other words, in a tier for each field and position, so the labels starting with some text are found by binary
+    search and the best N read off in order.
+    """
+    WORD = re.compile(r'\w+', re.UNICODE)
+    NGRAM = 3
+    FIELD_WEIGHTS = {
+        'prefLabel': 8,
+        'title': 8,
+        'altLabel': 4,
+        'hiddenLabel': 2,
+        'definition': 1,
+        'description': 1,
+    }
+    PREFIX_FIELDS = ('prefLabel', 'title', 'altLabel', 'hiddenLabel')
+
+    def __init__(self, documents):
+        """
+        :param documents: (item, {field: [label, ...]}) pairs, e.g. (concept dict, {'prefLabel': ['Granite'], ...})
+        :type documents: iterable
+        """
+        self._items = []
+        self._labels = []  # for each item, (field weight, label, normalised label) tuples
+        self._postings = {}  # trigram -> array of the numbers of the items with a label containing it
+        prefixes = {}  # score -> (normalised label from its start or a later word, item number, label) tuples
+        for item, fields in documents:
+            number = len(self._items)
+            labels = []
+            for field, field_labels in fields.items():
+                weight = self.FIELD_WEIGHTS.get(field, 1)
+                for label in field_labels:
+                    if not label:
+                        continue
+                    label, text = str(label), normalise(label)
+                    labels.append((weight, label, text))
+                    if field in self.PREFIX_FIELDS:
+                        prefixes.setdefault(weight * 3, []).append((text, number, label))
+                        for position, character in enumerate(text):
+                            if character == ' ':
+                                prefixes.setdefault(weight * 2, []).append((text[position + 1:], number, label))
+            self._items.append(item)
+            self._labels.append(labels)
+            for gram in set(gram for _weight, _label, text in labels for gram in self._ngrams(text)):
+                self._postings.setdefault(gram, array('I')).append(number)
+
+        # (score, sorted texts, (item number, label) for each text), best score first
+        self._prefix_tiers = []
+        for score in sorted(prefixes, reverse=True):
+            entries = sorted(prefixes[score])
+            self._prefix_tiers.append((score, [text for text, _number, _label in entries],
+                                       [(number, label) for _text, number, label in entries]))
+
+    def __len__(self):
+        return len(self._items)
+
+    def search(self, query):
+        """
+        :param query: text to find anywhere in the items' labels, ignoring case and punctuation
+        :return: (item, best matching label, score) for each matching item, best match first
+        :rtype: list
+        """
+        text = normalise(query)
+        if not text:
+            return []
+
+        grams = list(set(self._ngrams(text))) if len(text) >= self.NGRAM else []
+        if grams:
+            postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+            candidates = set(postings[0])
+            if len(postings) > 1:
+                candidates.intersection_update(postings[1])
+        else:
+            candidates = set()
+            for gram, posting in self._postings.items():
+                if text in gram:
+                    candidates.update(posting)
+
+        results = []
+        for number in candidates:
+            best = None
+            for weight, label, label_text in self._labels[number]:
+                quality = LabelIndex._match_quality(text, label_text)
+                if quality and (best is None or weight * quality > best[1]):
+                    best = (label, weight * quality)
+            if best is not None:
+                results.append((self._items[number], best[0], best[1], number))
+
+        # best score first, then in the order the items were given
+        results.sort(key=lambda result: (-result[2], result[3]))
+        return [(item, label, score) for item, label, score, _number in results]
+
+    def complete(self, query, limit):
+        """
+        :param query: text that a label, or a word in it, starts with, ignoring case and punctuation
+        :param limit: the most items to return
+        :return: (item, matching label, score) for up to limit items, best match first, then in label order
+        :rtype: list
+        """
+        text = normalise(query)
+        if not text:
+            return []
+
+        results = []
+        seen = set()
+        for score, texts, entries in self._prefix_tiers:
+            i = bisect_left(texts, text)
+            while i < len(texts) and texts[i].startswith(text):
+                number, label = entries[i]
+                i += 1
+                if number in seen:
+                    continue
+                seen.add(number)
+                results.append((self._items[number], label, score))
+                if len(results) >= limit:
+                    return results
+        return results
+
+    @staticmethod
+    def _match_quality(text, label_text):
+        if text == label_text:
+            return 4
+        if label_text.startswith(text):
+            return 3
+        if ' ' + text in label_text:
+            return 2
+        if text in label_text:
+            return 1
+        return 0
+
+    @classmethod
+    def _ngrams(cls, text):
+        if len(text) < cls.NGRAM:
+            return [text] if text else []
+        return [text[i:i + cls.NGRAM] for i in range(len(text) - cls.NGRAM + 1)]
+
+
+class SearchIndex:
+    """
+    Process-wide label indexes of the vocabs in the registry and of the concepts of each vocab, in each language, and
+    the LabelStore of each vocab's concepts that they are built from
+
+    The vocab index is rebuilt whenever the registry swaps in a refreshed set of vocabs. The concept index of a vocab in
+    DEFAULT_LANGUAGE is built in the background, by up to SEARCH_INDEX_WORKERS threads, when the vocab is first loaded,
+    and in any other language when it is first asked for. Each is built again when a refresh finds the vocab's modified
+    date or versionInfo changed, or it has neither. The concepts' labels in all languages are queried for once per
+    version of the vocab and kept in the cache store, so other languages and other worker processes don't query for
+    them again. Those of a vocab with neither are queried for again when it is refreshed, and kept for at most
+    VOCAB_CACHE_HOURS. Those of a purged vocab are queried for again in every worker process.
+    """
+    CACHE_FILE_NAME = 'LABELS_{}.p'
+
+    def __init__(self):
+        self.vocab_index = LabelIndex([])
+        self._vocabs = {}
+        # (vocab_id, language) -> (vocab version, LabelIndex of its concepts, LabelStore it was built from)
+        self._concept_indexes = {}
+        self._building = {}  # (vocab_id, language) -> Future of the build of its concept index
+        # vocab_id -> (vocab version, LabelStore of its concepts, time its labels were queried for)
+        self._label_stores = {}
+        self._label_store_locks = {}  # vocab_id -> Lock held while its LabelStore is loaded
+        self._failed = set()  # vocab_ids whose labels couldn't be queried for since the last update() or invalidate()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=getattr(config, 'SEARCH_INDEX_WORKERS', 2),
+                                            thread_name_prefix='search-index')
+        # results of searches across all vocabs, for paging through them, until a concept index changes
+        self.results_cache = TTLCache(getattr(config, 'SEARCH_RESULTS_CACHE_SECONDS', 300),
+                                      getattr(config, 'SEARCH_RESULTS_CACHE_SIZE', 100))
+        self._results_generation = 0  # incremented, with self._lock held, whenever results_cache is invalidated
+
+    def update(self, vocabs):
+        """
+        Indexes the given vocabs, replacing the previous ones, and starts building the concept indexes that are missing
+        or out of date
+        :param vocabs: Vocabulary objects, keyed by vocab_id
+        :type vocabs: dict
+        :return: nothing
+        """
+        self.vocab_index = LabelIndex(
+            (vocab, {'title': [vocab.title], 'description': [vocab.description]})
+            for vocab in sorted(vocabs.values(), key=lambda v: v.title)
+        )
+        self._vocabs = vocabs
+
+        with self._lock:
+            self._failed.clear()
+            for vocab_id, language in list(self._concept_indexes):
+                if vocab_id not in vocabs:
+                    del self._concept_indexes[(vocab_id, language)]
+                    self._invalidate_results()
+            for vocab_id in list(self._label_stores):
+                if vocab_id not in vocabs:
+                    del self._label_stores[vocab_id]
+            keys = set(self._concept_indexes)
+        keys.update((vocab_id, config.DEFAULT_LANGUAGE) for vocab_id in vocabs
+                    if vocabs[vocab_id].sparql_endpoint is not None)
+
+        for vocab_id, language in keys:
+            version = Source.vocab_version(vocabs[vocab_id])
+            indexed = self._concept_indexes.get((vocab_id, language))
+            if indexed is None or indexed[0] != version or version == (None, None):
+                self.build_async(vocab_id, language)
+
+    def build_async(self, vocab_id, language=None):
+        """
+        Starts building a vocab's concept index in the background, unless that is already under way
+        :return: the Future of the build
+        :rtype: concurrent.futures.Future
+        """
+        key = (vocab_id, language or config.DEFAULT_LANGUAGE)
+        with self._lock:
+            future = self._building.get(key)
+            if future is None or future.done():
+                future = self._building[key] = self._executor.submit(self.build, *key, requested_at=time.time())
+            return future
+
+    def build(self, vocab_id, language=None, requested_at=None):
+        """
+        Builds a vocab's concept index in a language, DEFAULT_LANGUAGE by default, from its LabelStore. The LabelStore of
+        a vocab with neither a modified date nor versionInfo is loaded again unless it was loaded since requested_at,
+        the time the build was asked for, as a change to the vocab can't otherwise be seen
+        :return: the index, or None if the vocab's concepts couldn't be got
+        :rtype: LabelIndex
+        """
+        language = language or config.DEFAULT_LANGUAGE
+        vocab = self._vocabs.get(vocab_id)
+        if vocab is not None and Source.vocab_version(vocab) == (None, None):
+            store = self.label_store(vocab_id, loaded_since=requested_at or time.time())
+        else:
+            store = self.label_store(vocab_id)
+        if store is None:
+            return None
+
+        index = LabelIndex(store.documents(language))
+        with self._lock:
+            loaded = self._label_stores.get(vocab_id)
+            # not if the vocab was dropped, or its LabelStore replaced or invalidated, while this was being built
+            if vocab_id in self._vocabs and loaded is not None and loaded[1] is store:
+                # shared by all the languages whose labels fall back to the same ones
+                self._concept_indexes[(vocab_id, store.label_language(language))] = \
+                    (Source.vocab_version(vocab), index, store)
+                if store.label_language(language) == store.label_language(config.DEFAULT_LANGUAGE):
+                    self._invalidate_results()
+        logging.debug('Indexed {} concepts of vocab {} in {}'.format(len(index), vocab_id, language))
+        return index
+
+    def label_store(self, vocab_id, wait=True, loaded_since=None):
+        """
+        Gets the LabelStore of a vocab's current version, loading it from the cache store or, failing that, from a query
+        for the labels of its concepts in all languages. Labels queried for before the vocab was last purged, by any
+        worker process, or, for a vocab with neither a modified date nor versionInfo, more than VOCAB_CACHE_HOURS ago
+        are not used
+        :param wait: if the LabelStore isn't loaded, whether to load it rather than return None
+        :param loaded_since: if given, labels queried for before this time are not used either
+        :return: the LabelStore, or None if the vocab's concepts couldn't be got
+        :rtype: data.labels.LabelStore
+        """
+        vocab = self._vocabs.get(vocab_id)
+        if vocab is None or vocab.sparql_endpoint is None:
+            return None
+        version = Source.vocab_version(vocab)
+        loaded = self._label_stores.get(vocab_id)
+        if loaded is not None and self._labels_current(vocab_id, version, loaded[0], loaded[2], loaded_since):
+            return loaded[1]
+        if not wait:
+            return None
+
+        with self._lock:
+            lock = self._label_store_locks.setdefault(vocab_id, threading.Lock())
+        with lock:  # so each language's build doesn't query for the same labels
+            loaded = self._label_stores.get(vocab_id)
+            if loaded is not None and self._labels_current(vocab_id, version, loaded[0], loaded[2], loaded_since):
+                return loaded[1]
+
+            key = self._cache_key(vocab_id)
+            cached = helper.cache_store.get(key, max_age=Source.version_cache_max_age(version))
+            if cached is not None and 'collected_at' in cached and \
+                    self._labels_current(vocab_id, version, cached['version'], cached['collected_at'], loaded_since):
+                concepts, collected_at = cached['concepts'], cached['collected_at']
+            else:
+                collected_at = time.time()
+                try:
+                    concepts = Source.collect_concept_labels(vocab)
+                except Exception as e:
+                    logging.error('Unable to get the concept labels of vocab {}: {}'.format(vocab_id, e))
+                    self._failed.add(vocab_id)
+                    return None
+                helper.cache_store.set(key, {'version': version, 'concepts': concepts, 'collected_at': collected_at})
+
+            store = LabelStore(vocab_id, concepts)
+            self._label_stores[vocab_id] = (version, store, collected_at)
+            return store
+
+    def invalidate(self, vocab_id):
+        """
+        Drops a vocab's LabelStore and concept indexes, in memory and in the cache store, and starts building its
+        concept index again, from newly queried labels
+        :return: nothing
+        """
+        with self._lock:
+            self._label_stores.pop(vocab_id, None)
+            self._failed.discard(vocab_id)
+            for key in [key for key in self._concept_indexes if key[0] == vocab_id]:
+                del self._concept_indexes[key]
+            self._invalidate_results()
+        helper.cache_store.delete(self._cache_key(vocab_id))
+        if vocab_id in self._vocabs:
+            self.build_async(vocab_id)
+
+    @staticmethod
+    def _labels_current(vocab_id, version, labels_version, collected_at, loaded_since=None):
+        if labels_version != version or collected_at < Source.purge_generation(vocab_id):
+            return False
+        if loaded_since is not None and collected_at < loaded_since:
+            return False
+        max_age = Source.version_cache_max_age(version)
+        return max_age is None or time.time() - collected_at < max_age
+
+    @classmethod
+    def _cache_key(cls, vocab_id):
+        return cls.CACHE_FILE_NAME.format(re.sub(r'[^\w.-]', '_', vocab_id))
+
+    def concept_index(self, vocab_id, language=None, wait=True):
+        """
+        :param language: language of the index, DEFAULT_LANGUAGE by default
+        :param wait: if the vocab's concept index hasn't been built yet, whether to wait for it rather than start
+        building it in the background and return None. It isn't started for a vocab without a SPARQL endpoint, nor one
+        whose labels couldn't be queried for, until the next update()
+        :return: the vocab's concept index, or None if there isn't one
+        :rtype: LabelIndex
+        """
+        store = self.label_store(vocab_id, wait)
+        if store is None:
+            vocab = self._vocabs.get(vocab_id)
+            if not wait and vocab is not None and vocab.sparql_endpoint is not None and vocab_id not in self._failed:
+                self.build_async(vocab_id, language)
+            return None
+        label_language = store.label_language(language or config.DEFAULT_LANGUAGE)
+        indexed = self._concept_indexes.get((vocab_id, label_language))
+        if indexed is not None and indexed[2] is store:  # not built from labels that have since been replaced
+            return indexed[1]
+        future = self.build_async(vocab_id, label_language)
+        return future.result() if wait else None
+
+    def search_vocabs(self, query):
+        """
+        :return: the vocabs whose title or description contains query, best match first
+        :rtype: list
+        """
+        return [vocab for vocab, _label, _score in self.vocab_index.search(query)]
+
+    def search_concepts(self, vocab_id, query, language=None, wait=True):
+        """
+        :param wait: if the vocab's concept index hasn't been built yet, whether to wait for it, as concept_index()
+        :return: the concepts of a vocab, as list_concepts() gives them, whose labels or definition in language contain
+        query, best match first, or None if the vocab's concepts couldn't be indexed or aren't indexed yet
+        :rtype: list
+        """
+        index = self.concept_index(vocab_id, language, wait)
+        if index is None:
+            return None
+        return [concept for concept, _label, _score in index.search(query)]
+
+    def complete(self, vocab_id, query, limit, language=None, wait=True):
+        """
+        :param wait: if the vocab's concept index hasn't been built yet, whether to wait for it, as concept_index()
+        :return: up to limit (concept, matching label) pairs for the concepts of a vocab with a label in language that
+        starts with query, or has a word that does, best match first, or None if the vocab's concepts couldn't be
+        indexed or aren't indexed yet
+        :rtype: list
+        """
+        index = self.concept_index(vocab_id, language, wait)
+        if index is None:
+            return None
+        return [(concept, label) for concept, label, _score in index.complete(query, limit)]
+
+    def search_all(self, query):
+        """
+        Searches the DEFAULT_LANGUAGE concept indexes of all the vocabs together, as one global index. Vocabs whose
+        concept index is still being built are left out rather than waited for. The results are kept in results_cache,
+        so paging through them doesn't repeat the search.
+        :return: (concept, matching label, score) for each matching concept of any vocab, best match first, then in
+        vocab title order, the vocab_id being the concept's 'key'
+        :rtype: list
+        """
+        key = normalise(query)
+        results = self.results_cache.get(key)
+        if results is not None:
+            return results
+        generation = self._results_generation
+
+        vocabs = self._vocabs
+        # vocabs without a SPARQL endpoint have no concept labels to index
+        indexes = {vocab_id: self.concept_index(vocab_id, wait=False) for vocab_id in vocabs
+                   if vocabs[vocab_id].sparql_endpoint is not None}
+        vocab_ids = sorted((vocab_id for vocab_id in indexes if indexes[vocab_id] is not None),
+                           key=lambda vocab_id: vocabs[vocab_id].title)
+        # each vocab's results are already best match first
+        results = list(heapq.merge(*(indexes[vocab_id].search(query) for vocab_id in vocab_ids),
+                                   key=lambda result: -result[2]))
+        with self._lock:
+            # not if a concept index changed during the search, as the results may be from the index it replaced
+            if self._results_generation == generation:
+                self.results_cache.set(key, results)
+        return results
+
+    def _invalidate_results(self):
+        # with self._lock held
+        self._results_generation += 1
+        self.results_cache.invalidate()
+
+    def status(self):
+        return {
+            'vocabs': len(self.vocab_index),
+            'indexed_vocabs': len(set(vocab_id for vocab_id, _language in list(self._concept_indexes))),
+            'indexed_languages': sorted(set(language for _vocab_id, language in list(self._concept_indexes))),
+            'indexed_concepts': sum(len(index) for _version, index, _store in list(self._concept_indexes.values())),
+            'building': sum(1 for future in list(self._building.values()) if not future.done()),
+            'failed': sorted(self._failed),
+            'results_cache': self.results_cache.stats(),
+        }
+
+
+# the search index for this worker process
+search_index = SearchIndex()
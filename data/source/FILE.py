@@ -1,4 +1,5 @@
 from data.source._source import Source
+from data.hierarchy import build_hierarchy
 from os.path import join
 import _config as config
 from rdflib import Graph, URIRef, RDF
@@ -263,81 +264,42 @@ class FILE(Source):
         pass
 
     def get_concept_hierarchy(self):
-        # return FILE.hierarchy[self.vocab_id]
-        pass
-        g = FILE.load_pickle_graph(self.vocab_id)
-        result = g.query(
-            """
-            PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
-
-            SELECT (COUNT(?mid) AS ?length) ?c ?pl ?parent
-            WHERE {{ 
-                ?c      a                                       skos:Concept .   
-                ?cs     (skos:hasTopConcept | skos:narrower)*   ?mid .
-                ?mid    (skos:hasTopConcept | skos:narrower)+   ?c .                      
-                ?c      skos:prefLabel                          ?pl .
-                ?c		(skos:topConceptOf | skos:broader)		?parent .
-                FILTER (?cs = <{}>)
-            }}
-            GROUP BY ?c ?pl ?parent
-            ORDER BY ?length ?parent ?pl
-            """.format(self.uri)
-        )
-
-        cs = []
-        for row in result:
-            cs.append({
-                'length': {'value': row['length']},
-                'c': {'value': row['c']},
-                'pl': {'value': row['pl']},
-                'parent': {'value': row['parent']}
-            })
-
-        hierarchy = []
-        previous_parent_uri = None
-        last_index = 0
-
-        for c in cs:
-            # insert all topConceptOf directly
-            if str(c['parent']['value']) == self.uri:
-                hierarchy.append((
-                    int(c['length']['value']),
-                    c['c']['value'],
-                    c['pl']['value'],
-                    None
-                ))
-            else:
-                # If this is not a topConcept, see if it has the same URI as the previous inserted Concept
-                # If so, use that Concept's index + 1
-                this_parent = c['parent']['value']
-                if this_parent == previous_parent_uri:
-                    # use last inserted index
-                    hierarchy.insert(last_index + 1, (
-                        int(c['length']['value']),
-                        c['c']['value'],
-                        c['pl']['value'],
-                        c['parent']['value']
-                    ))
-                    last_index += 1
-                # This is not a TopConcept and it has a differnt parent from the previous insert
-                # So insert it after it's parent
-                else:
-                    i = 0
-                    parent_index = 0
-                    for t in hierarchy:
-                        if this_parent in t[1]:
-                            parent_index = i
-                        i += 1
-
-                    hierarchy.insert(parent_index + 1, (
-                        int(c['length']['value']),
-                        c['c']['value'],
-                        c['pl']['value'],
-                        c['parent']['value']
-                    ))
-
-                    last_index = parent_index + 1
-                previous_parent_uri = this_parent
+        # walk the graph's triple indexes directly, as rdflib evaluates the (skos:hasTopConcept | skos:narrower)*
+        # property paths and COUNT() needed to get depths by SPARQL combinatorially
+        scheme = URIRef(self.uri)
+        concepts = set(self.g.subjects(RDF.type, SKOS.Concept))
+
+        # a prefLabel in this Source's language, else one with no language, else any
+        labels = {}
+        for c, pl in self.g.subject_objects(SKOS.prefLabel):
+            if c not in concepts:
+                continue
+            rank = 0 if pl.language == self.language else 1 if not pl.language else 2
+            if c not in labels or rank < labels[c][0]:
+                labels[c] = (rank, str(pl))
+
+        # the same concept hierarchy query bindings as Source._concept_hierarchy_query() gives, from either direction
+        # of each relationship
+        bindings_list = []
+
+        def add_binding(c, parent):
+            if c not in labels:
+                return
+            binding_dict = {'concept': {'value': str(c)}, 'concept_preflabel': {'value': labels[c][1]}}
+            if parent is not None:
+                binding_dict['broader_concept'] = {'value': str(parent)}
+            bindings_list.append(binding_dict)
+
+        for c in self.g.objects(scheme, SKOS.hasTopConcept):
+            add_binding(c, None)
+        for c in self.g.subjects(SKOS.topConceptOf, scheme):
+            add_binding(c, None)
+        for c, parent in self.g.subject_objects(SKOS.broader):
+            add_binding(c, parent)
+        for parent, c in self.g.subject_objects(SKOS.narrower):
+            add_binding(c, parent)
+
+        hierarchy = build_hierarchy(bindings_list)
         return Source.draw_concept_hierarchy(hierarchy, self.request, self.vocab_id)
 
     @staticmethod
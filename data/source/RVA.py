@@ -1,9 +1,10 @@
 import logging
+import threading
 import requests
-import json
 import dateutil.parser
-from flask import g
+from concurrent.futures import ThreadPoolExecutor
 from data.source._source import Source
+from data.http_pool import http_pool
 from model.vocabulary import Vocabulary
 import _config as config
 
@@ -11,6 +12,10 @@ import _config as config
 class RVA(Source):
     """Source for Research Vocabularies Australia
     """
+    # validators (ETag, Last-Modified) and JSON of each catalogue API response, keyed by URL, so that collect() can make
+    # conditional requests and an unchanged vocab costs a 304 rather than its full JSON
+    _catalogue_cache = {}
+    _catalogue_cache_lock = threading.Lock()
 
     def __init__(self, vocab_id, request, language=None):
         super().__init__(vocab_id, request, language)
@@ -18,7 +23,8 @@ class RVA(Source):
     @staticmethod
     def collect(details):
         """
-        For this source, vocabs must be nominated via their ID (a number) in details['vocab_ids']
+        For this source, vocabs must be nominated via their ID (a number) in details['vocab_ids']. Returns the vocabs,
+        keyed by vocab_id
 
         'rva': {
             'source': VocabSource.RVA,
@@ -38,33 +44,75 @@ class RVA(Source):
                 }
             ]
         }
+
+        The catalogue entries are fetched concurrently over the API's pooled, keep-alive connections by up to
+        details['max_workers'] (default 8) threads, each request timing out after details['timeout'] (default 60)
+        seconds.
         """
 
         # Get the details for each vocab from the RVA catalogue API
         logging.debug('RVA collect()...')
-        rva_vocabs = {}
-        for vocab in details['vocabs']:
-            r = requests.get(
-                    details['api_endpoint'].format(vocab['ardc_id']),
-                    headers={'Accept': 'application/json'}
-            )
-            if r.status_code == 200:
-                j = json.loads(r.text)
-                vocab_id = 'rva-' + str(vocab['ardc_id'])
-                rva_vocabs[vocab_id] = Vocabulary(
-                    vocab_id,
-                    vocab['uri'],
-                    j['title'],
-                    j.get('description'),
-                    j.get('creator'),
-                    dateutil.parser.parse(j.get('creation-date')),
-                    None,
-                    j['version'][0]['title'],
-                    config.VocabSource.RVA,
-                    vocab['uri'],
-                    sparql_endpoint=j['version'][0]['access-point'][0]['ap-api-sparql']['url']
-                )
-            else:
+        def get_vocab(vocab):
+            j = RVA._get_catalogue_entry(details['api_endpoint'].format(vocab['ardc_id']),
+                                         details.get('timeout', 60))
+            if j is None:
                 logging.error('Could not get vocab {} from RVA'.format(vocab['ardc_id']))
-        g.VOCABS = {**g.VOCABS, **rva_vocabs}
+                return None
+
+            vocab_id = 'rva-' + str(vocab['ardc_id'])
+            return Vocabulary(
+                vocab_id,
+                vocab['uri'],
+                j['title'],
+                j.get('description'),
+                j.get('creator'),
+                dateutil.parser.parse(j.get('creation-date')),
+                None,
+                j['version'][0]['title'],
+                config.VocabSource.RVA,
+                vocab['uri'],
+                sparql_endpoint=j['version'][0]['access-point'][0]['ap-api-sparql']['url']
+            )
+
+        with ThreadPoolExecutor(max_workers=details.get('max_workers', 8), thread_name_prefix='rva-collect') as executor:
+            rva_vocabs = {v.id: v for v in executor.map(get_vocab, details['vocabs']) if v is not None}
         logging.debug('RVA collect() complete')
+        return rva_vocabs
+
+    @staticmethod
+    def _get_catalogue_entry(url, timeout):
+        """
+        Gets the JSON for one vocab from the RVA catalogue API, conditionally if it has been fetched before
+        :param url: the catalogue API URL of the vocab
+        :param timeout: seconds to wait for the API
+        :return: the catalogue entry or None if it couldn't be got
+        :rtype: dict
+        """
+        headers = {'Accept': 'application/json'}
+        cached = RVA._catalogue_cache.get(url)
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            r = http_pool.get(url, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            logging.error('RVA catalogue request {} failed: {}'.format(url, e))
+            return None
+
+        if r.status_code == 304 and cached is not None:
+            logging.debug('RVA catalogue entry {} not modified'.format(url))
+            return cached['json']
+        elif r.status_code == 200:
+            j = r.json()
+            with RVA._catalogue_cache_lock:
+                RVA._catalogue_cache[url] = {
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'json': j
+                }
+            return j
+        else:
+            return None
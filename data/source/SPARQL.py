@@ -1,6 +1,5 @@
 import logging
 import dateutil.parser
-from flask import g
 from data.source._source import Source
 from model.vocabulary import Vocabulary
 import _config as config
@@ -21,7 +20,8 @@ class SPARQL(Source):
     @staticmethod
     def collect(details):
         """
-        For this source, one SPARQL endpoint is given for a series of vocabs which are all separate ConceptSchemes
+        For this source, one SPARQL endpoint is given for a series of vocabs which are all separate ConceptSchemes.
+        Returns the vocabs, keyed by vocab_id
 
         'ga-jena-fuseki': {
             'source': VocabSource.SPARQL,
@@ -32,6 +32,7 @@ class SPARQL(Source):
             #'uri_filter_regex': '^http(s?)://pid.geoscience.gov.au/def/voc/ga/', # Regular expression to filter vocabulary URIs - GA
             #'uri_filter_regex': '^https://gcmdservices.gsfc.nasa.gov', # Regular expression to filter vocabulary URIs - GCMD
             'uri_filter_regex': '^http(s?)://resource.geosciml.org/', # Regular expression to filter vocabulary URIs - CGI
+            #'hierarchy_page_size': 10000, # Optional, to fetch concept hierarchies in pages of this many edges
 
         },
         """
@@ -71,7 +72,8 @@ SELECT * WHERE {{
 ORDER BY ?title'''.format(language=DEFAULT_LANGUAGE)
         # record just the IDs & title for the VocPrez in-memory vocabs list
         concept_schemes = Source.sparql_query(details['sparql_endpoint'], q, 
-                                              sparql_username=details.get('sparql_username'), sparql_password=details.get('sparql_password')
+                                              sparql_username=details.get('sparql_username'), sparql_password=details.get('sparql_password'),
+                                              use_cache=False
                                               )
         assert concept_schemes is not None, 'Unable to query conceptSchemes'
         
@@ -104,7 +106,8 @@ ORDER BY ?title'''.format(language=DEFAULT_LANGUAGE)
                 cs['cs']['value'],
                 sparql_endpoint=details['sparql_endpoint'],
                 sparql_username=details['sparql_username'],
-                sparql_password=details['sparql_password']
+                sparql_password=details['sparql_password'],
+                hierarchy_page_size=details.get('hierarchy_page_size')
             )
-        g.VOCABS = {**g.VOCABS, **sparql_vocabs}
         logging.debug('SPARQL collect() complete.')
+        return sparql_vocabs
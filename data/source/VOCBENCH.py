@@ -1,4 +1,5 @@
 from data.source._source import Source
+from data.hierarchy import build_hierarchy
 import requests
 import json
 import _config as config
@@ -453,6 +454,12 @@ class VOCBENCH(Source):
     def get_concept_hierarchy(self, concept_scheme_uri):
         # returns an ordered list of tuples, (hierarchy level, Concept URI, Concept prefLabel)
         s = VOCBENCH('x', self.request)._authed_request_object()
+        # the project's own mode, if it has one, so that one large project doesn't need every project to use edges
+        mode = getattr(config, 'VB_HIERARCHY_MODES', {}).get(self.vocab_id,
+                                                             getattr(config, 'VB_HIERARCHY_MODE', 'paths'))
+        if mode == 'edges':
+            return self._get_concept_hierarchy_from_edges(s, concept_scheme_uri)
+
         r = s.post(
             config.VB_ENDPOINT + '/SPARQL/evaluateQuery',
             data={
@@ -534,6 +541,68 @@ class VOCBENCH(Source):
         else:
             raise VbException('There was an error: ' + r.content.decode('utf-8'))
 
+    def _get_concept_hierarchy_from_edges(self, s, concept_scheme_uri):
+        # fetches only the flat list of broader/narrower edges between concepts in the scheme, and of its top
+        # concepts, VB_HIERARCHY_PAGE_SIZE at a time, and builds the hierarchy from it here, as the triplestore can run
+        # out of heap evaluating the property path GROUP BY query
+        page_size = getattr(config, 'VB_HIERARCHY_PAGE_SIZE', 10000)
+        bindings_list = []
+        offset = 0
+        while True:
+            r = s.post(
+                config.VB_ENDPOINT + '/SPARQL/evaluateQuery',
+                data={
+                    'query':
+                        '''
+                        PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+                        SELECT ?c ?pl ?parent
+                        WHERE {{
+                            ?c      a                   skos:Concept ;
+                                    skos:prefLabel      ?pl .
+                            {{
+                                {{ ?c skos:topConceptOf <{scheme}> }}
+                                UNION
+                                {{ <{scheme}> skos:hasTopConcept ?c }}
+                                BIND(<{scheme}> AS ?parent)
+                            }}
+                            UNION
+                            {{
+                                {{ ?c skos:broader ?parent }}
+                                UNION
+                                {{ ?parent skos:narrower ?c }}
+                                ?c      skos:inScheme       <{scheme}> .
+                                ?parent skos:inScheme       <{scheme}> .
+                            }}
+                        }}
+                        ORDER BY ?c ?parent ?pl
+                        LIMIT {limit} OFFSET {offset}'''.format(scheme=concept_scheme_uri, limit=page_size,
+                                                                 offset=offset),
+                    'ctx_project': self.vocab_id
+                }
+            )
+            if r.status_code != 200:
+                raise VbException('There was an error: ' + r.content.decode('utf-8'))
+
+            try:
+                page = json.loads(r.content.decode('utf-8'))['result']['sparql']['results']['bindings']
+            except:
+                raise VbException(r.content.decode('utf-8'))
+
+            for c in page:
+                binding_dict = {'concept': c['c'], 'concept_preflabel': c['pl']}
+                if c['parent']['value'] != concept_scheme_uri:
+                    binding_dict['broader_concept'] = c['parent']
+                bindings_list.append(binding_dict)
+
+            if len(page) < page_size:
+                break
+            offset += page_size
+
+        # the prefLabels are in every language, so that the pages are shared by all languages
+        hierarchy = build_hierarchy(self._hierarchy_in_fallback_language(bindings_list))
+        return Source.draw_concept_hierarchy(hierarchy, self.request, self.vocab_id)
+
     def get_object_class(self, uri):
         """Gets the class of the object.
 
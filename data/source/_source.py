@@ -1,18 +1,26 @@
 import _config as config
 from rdflib import Graph, URIRef
 from rdflib.namespace import SKOS
-import markdown
-from flask import g
-from SPARQLWrapper import SPARQLWrapper, JSON, BASIC
+from flask import g, Markup
 import dateutil
 from model.concept import Concept
 from collections import OrderedDict
+from copy import copy
+from concurrent.futures import ThreadPoolExecutor
 from helper import make_title, url_decode, cache_read, cache_write
+import csv
+import io
+import json
 import logging
+import re
+import time
 import base64
-import requests
-from time import sleep
+import hashlib
 import helper as h
+from data.cache import TTLCache
+from data.hierarchy import HierarchyClosure, build_hierarchy, hierarchy_narrowers, render_hierarchy_html, render_lazy_hierarchy_html
+from data.labels import LabelStore
+from data.http_pool import http_pool
 
 # Default to English if no DEFAULT_LANGUAGE in config
 if hasattr(config, 'DEFAULT_LANGUAGE:'):
@@ -29,10 +37,47 @@ class Source:
         'http://www.w3.org/2004/02/skos/core#Concept',
     ]
 
+    # threads with which sparql_queries() makes its queries concurrently, shared by all requests in this worker process
+    query_executor = ThreadPoolExecutor(max_workers=getattr(config, 'SPARQL_QUERY_WORKERS', 8),
+                                        thread_name_prefix='sparql-query')
+
+    # threads with which crawl_narrowers() fetches concepts' Turtle, shared by all requests in this worker process
+    crawl_executor = ThreadPoolExecutor(max_workers=getattr(config, 'NARROWERS_CRAWL_WORKERS', 8),
+                                        thread_name_prefix='narrowers-crawl')
+
+    # memoised sparql_query() results, shared by all requests in this worker process
+    query_cache = TTLCache(getattr(config, 'SPARQL_QUERY_CACHE_SECONDS', 300),
+                           getattr(config, 'SPARQL_QUERY_CACHE_SIZE', 1000))
+
+    # hierarchy_narrowers() indexes and HierarchyClosures of concept hierarchies, keyed by kind, vocab_id, language and
+    # vocab version
+    hierarchy_index_cache = TTLCache(config.VOCAB_CACHE_HOURS * 3600, getattr(config, 'HIERARCHY_INDEX_CACHE_SIZE', 50))
+
+    # concept hierarchy lists of a vocab in each language, in the cache store, keyed by vocab_id
+    HIERARCHY_CACHE_FILE_NAME = 'HIERARCHY_{}.p'
+    # length of the last concept hierarchy list of a vocab that any worker process built, in the cache store so that
+    # every worker process sees it, and kept across versions of the vocab, keyed by vocab_id
+    HIERARCHY_SIZE_FILE_NAME = 'HIERARCHY_SIZE_{}.p'
+
+    # purge markers of vocabs, in the cache store so that every worker process sees them, keyed by vocab_id
+    PURGE_MARKER_FILE_NAME = 'PURGED_{}.p'
+    _purges_seen = {}  # vocab_id -> generation of the last purge of the vocab that this worker process has seen
+    _purges_applied = {}  # vocab_id -> generation of the last purge of the vocab that this worker process has applied
+    _purges_checked = {}  # vocab_id -> time at which this worker process last read the vocab's purge marker
+
+    # formats of export_concepts() -> their media types
+    EXPORT_FORMATS = OrderedDict([
+        ('csv', 'text/csv'),
+        ('jsonl', 'application/x-ndjson'),
+        ('nt', 'application/n-triples'),
+    ])
+    EXPORT_FIELDS = ['uri', 'prefLabel', 'definition', 'created', 'modified']
+
     def __init__(self, vocab_id, request, language=None):
         self.vocab_id = vocab_id
         self.request = request
         self.language = language or DEFAULT_LANGUAGE
+        Source.apply_purge(vocab_id)
         
         self._graph = None # Property for rdflib Graph object to be populated on demand
 
@@ -40,9 +85,9 @@ class Source:
     def collect(details):
         """
         Specialised Sources must implement a collect method to get all the vocabs of their sort, listed in
-        _config/__init__.py, at startup
+        _config/__init__.py, at startup. It returns a dict of Vocabulary objects keyed by vocab_id
         """
-        pass
+        return {}
 
     def list_collections(self):
         vocab = g.VOCABS[self.vocab_id]
@@ -53,58 +98,132 @@ WHERE {{
     {{ GRAPH ?g {{
         ?c a skos:Collection .
         {{?c (rdfs:label | skos:prefLabel) ?l .
-        FILTER(lang(?l) = "{language}" || lang(?l) = "") 
         }}
     }} }}
     UNION
     {{
         ?c a skos:Collection .
         {{?c (rdfs:label | skos:prefLabel) ?l .
-        FILTER(lang(?l) = "{language}" || lang(?l) = "") 
         }}
     }} 
-}}'''.format(language=self.language)
-        collections = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
+}}'''
+        collections = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
 
-        return [(x.get('c').get('value'), x.get('l').get('value')) for x in collections]
+        return [(x.get('c').get('value'), x.get('l').get('value'))
+                for x in self._in_fallback_language(collections, lambda x: x['c']['value'], 'l')]
 
-    def list_concepts(self):
+    def list_concepts(self, limit=None, offset=0):
+        """
+        Lists the concepts of the vocab in prefLabel order, or a page of them
+
+        :param limit: the number of concepts in the page, or None for all of them
+        :type limit: int
+        :param offset: the number of concepts before the page
+        :type offset: int
+        :return: a dict of the URI, prefLabel, definition and dates of each concept
+        :rtype: list
+        """
         vocab = g.VOCABS[self.vocab_id]
-        q = '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+        concepts = Source.sparql_query(vocab.sparql_endpoint, self._concepts_query(limit, offset), vocab.sparql_username,
+                                       vocab.sparql_password, vocab_id=self.vocab_id)
+        return self._concept_items(concepts)
+
+    def list_concepts_page(self, limit, offset=0):
+        """
+        Gets a page of the vocab's concepts, in prefLabel order, and the number of concepts in the vocab, with a query
+        for the page and a COUNT query made at the same time, so only the page's concepts are transferred and parsed
+
+        :return: (the concepts in the page as list_concepts() gives them, the number of concepts in the vocab)
+        :rtype: tuple
+        """
+        vocab = g.VOCABS[self.vocab_id]
+        concepts, count = Source.sparql_queries(vocab.sparql_endpoint,
+                                                [self._concepts_query(limit, offset), self._concepts_count_query()],
+                                                vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
+        return self._concept_items(concepts), int(count[0]['count']['value']) if count else 0
+
+    def _concepts_query(self, limit=None, offset=0):
+        # the concepts, and the page of them if there is a limit, are chosen by prefLabel alone, before getting their
+        # definitions and dates, so that a page is a page of concepts rather than of rows. A concept with several
+        # prefLabels in the first language of the fallback chain that it has one in is given the lowest of them, so
+        # that it takes one place in the order. Unlike the other queries, these depend on the language, as the order
+        # does
+        return '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 PREFIX dct: <http://purl.org/dc/terms/>
-SELECT DISTINCT *
+SELECT DISTINCT ?c ?pl ?d ?created ?modified
 WHERE {{
-    {{ GRAPH ?g {{
-        ?c skos:inScheme <{concept_scheme_uri}> . 
-        {{ ?c skos:prefLabel ?pl .
-        FILTER(lang(?pl) = "{language}" || lang(?pl) = "") 
-        }}
-        OPTIONAL {{ ?c skos:definition ?d .
-        FILTER(lang(?d) = "{language}" || lang(?d) = "") 
-        }}
-        OPTIONAL {{ ?c dct:created ?created . }}
-        OPTIONAL {{ ?c dct:modified ?modified . }}
-    }} }}
-    UNION
     {{
-        ?c skos:inScheme <{concept_scheme_uri}> . 
-        {{ ?c skos:prefLabel ?pl .
-        FILTER(lang(?pl) = "{language}" || lang(?pl) = "") 
+        SELECT ?c (MIN(?label) AS ?pl)
+        WHERE {{
+            {pattern}
         }}
-        OPTIONAL {{ ?c skos:definition ?d .
-        FILTER(lang(?d) = "{language}" || lang(?d) = "") 
-        }}
-        OPTIONAL {{ ?c dct:created ?created . }}
-        OPTIONAL {{ ?c dct:modified ?modified . }}
+        GROUP BY ?c
+        ORDER BY ?pl ?c
+        {page}
     }}
+    {definition}
+    OPTIONAL {{ {{ GRAPH ?g {{ ?c dct:created ?created . }} }} UNION {{ ?c dct:created ?created . }} }}
+    OPTIONAL {{ {{ GRAPH ?g {{ ?c dct:modified ?modified . }} }} UNION {{ ?c dct:modified ?modified . }} }}
 }}
-ORDER BY ?pl'''.format(concept_scheme_uri=vocab.concept_scheme_uri, 
-                        language=self.language)
-        concepts = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
+ORDER BY ?pl ?c'''.format(pattern=self._concepts_pattern(),
+                        definition=self._fallback_language_pattern('?c', 'skos:definition', 'd'),
+                        page='LIMIT {} OFFSET {}'.format(limit, offset) if limit is not None else '')
+
+    def _concepts_count_query(self):
+        return '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+SELECT (COUNT(DISTINCT ?c) AS ?count)
+WHERE {{
+    {pattern}
+}}'''.format(pattern=self._concepts_pattern())
+
+    def _concepts_pattern(self):
+        return '''{{ GRAPH ?g {{ ?c skos:inScheme <{concept_scheme_uri}> . }} }}
+            UNION
+            {{ ?c skos:inScheme <{concept_scheme_uri}> . }}
+            {label}
+            FILTER(BOUND(?label))'''.format(concept_scheme_uri=g.VOCABS[self.vocab_id].concept_scheme_uri,
+                                           label=self._fallback_language_pattern('?c', 'skos:prefLabel', 'label'))
 
-        concept_items = []
-        for concept in concepts:
-            metadata = {
+    def _fallback_language_pattern(self, subject, predicate, variable):
+        # binds ?variable to the values of subject's predicate in the first language of this Source's fallback chain
+        # that it has any in, leaving it unbound if it has none in any of them
+        chain = LabelStore.fallback_chain(self.language)
+        optionals = ['''OPTIONAL {{
+                {{ GRAPH ?{variable}_g{i} {{ {subject} {predicate} ?{variable}_{i} . }} }}
+                UNION
+                {{ {subject} {predicate} ?{variable}_{i} . }}
+                FILTER(LCASE(lang(?{variable}_{i})) = "{language}")
+            }}'''.format(subject=subject, predicate=predicate, variable=variable, i=i, language=language)
+                     for i, language in enumerate(chain)]
+        return '\n            '.join(optionals + ['BIND(COALESCE({}) AS ?{})'.format(
+            ', '.join('?{}_{}'.format(variable, i) for i in range(len(chain))), variable)])
+
+    def _in_fallback_language(self, bindings, key, label):
+        '''
+        Function to keep, of query bindings with the label variable in any language, those with it in the first language
+        of this Source's fallback chain (LabelStore.fallback_chain()) that there is one in among the bindings with the
+        same key(binding), so that the queries needn't filter by language and are shared by all languages. Where there
+        is no label in any language of the chain, those with one in another language, or none, are kept. The order of
+        the bindings is kept
+        '''
+        chain = LabelStore.fallback_chain(self.language)
+
+        def rank(binding):
+            language = binding[label].get('xml:lang', '').lower() if binding.get(label) else None
+            return chain.index(language) if language in chain else len(chain)
+
+        best = {}
+        for binding in bindings or []:
+            best[key(binding)] = min(best.get(key(binding), len(chain)), rank(binding))
+        return [binding for binding in bindings or [] if rank(binding) == best[key(binding)]]
+
+    def _concept_items(self, concepts):
+        # a concept with several definitions or dates, or in several graphs, has several rows: keep the first
+        concept_items = OrderedDict()
+        for concept in concepts or []:
+            if concept['c']['value'] in concept_items:
+                continue
+            concept_items[concept['c']['value']] = {
                 'key': self.vocab_id,
                 'uri': concept['c']['value'],
                 'title': concept['pl']['value'],
@@ -113,9 +232,151 @@ ORDER BY ?pl'''.format(concept_scheme_uri=vocab.concept_scheme_uri,
                 'modified': dateutil.parser.parse(concept['modified']['value']) if concept.get('modified') else None
             }
 
-            concept_items.append(metadata)
+        return list(concept_items.values())
 
-        return concept_items
+    def export_concepts(self, export_format):
+        """
+        Exports all the vocab's concepts, line by line, from queries for EXPORT_PAGE_SIZE concepts, or for N-Triples
+        triples, at a time, so that memory use doesn't grow with the size of the vocab. Pages aren't kept in the query
+        cache. The first page is queried for straight away, so that a failure to get it can be answered with an error
+        rather than an empty export; a later page failing raises an Exception as the lines are generated.
+
+        :param export_format: one of EXPORT_FORMATS: 'csv' or 'jsonl' for the EXPORT_FIELDS of each concept, in
+        prefLabel order, or 'nt' for all the triples about the concepts, except those with a blank node, whose labels
+        are only meaningful within the results of the query that gave them
+        :type export_format: str
+        :return: a generator of lines of text, or None if the first page couldn't be got
+        :rtype: generator
+        """
+        vocab = g.VOCABS[self.vocab_id]
+        page_size = getattr(config, 'EXPORT_PAGE_SIZE', 1000)
+        page_query = self._concept_triples_query if export_format == 'nt' else self._concepts_query
+
+        def query_page(offset):
+            return Source.sparql_query(vocab.sparql_endpoint, page_query(page_size, offset), vocab.sparql_username,
+                                       vocab.sparql_password, use_cache=False)
+
+        def pages(page):
+            offset = 0
+            while True:
+                yield page
+                if len(page) < page_size:
+                    return
+                offset += page_size
+                page = query_page(offset)
+                if page is None:
+                    raise Exception('Unable to query the concepts of vocab {} from offset {}'.format(
+                        self.vocab_id, offset))
+
+        def lines(first_page):
+            if export_format == 'nt':
+                for page in pages(first_page):
+                    for triple in page:
+                        if triple['s']['type'] == 'bnode' or triple['o']['type'] == 'bnode':
+                            continue
+                        yield '{} {} {} .\n'.format(Source._ntriples_term(triple['s']),
+                                                    Source._ntriples_term(triple['p']),
+                                                    Source._ntriples_term(triple['o']))
+                return
+
+            if export_format == 'csv':
+                line = io.StringIO()
+                writer = csv.writer(line, lineterminator='\n')
+                writer.writerow(self.EXPORT_FIELDS)
+                yield line.getvalue()
+            for page in pages(first_page):
+                for concept in self._concept_items(page):
+                    row = [concept['uri'], concept['title'], concept['definition'],
+                           concept['created'].isoformat() if concept['created'] else None,
+                           concept['modified'].isoformat() if concept['modified'] else None]
+                    if export_format == 'csv':
+                        line.seek(0)
+                        line.truncate()
+                        writer.writerow(row)
+                        yield line.getvalue()
+                    else:
+                        yield json.dumps(OrderedDict(zip(self.EXPORT_FIELDS, row))) + '\n'
+
+        first_page = query_page(0)
+        if first_page is None:
+            return None
+        return lines(first_page)
+
+    def _concept_triples_query(self, limit, offset=0):
+        return '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+SELECT DISTINCT ?s ?p ?o
+WHERE {{
+    {{ GRAPH ?g {{ ?s skos:inScheme <{concept_scheme_uri}> ; ?p ?o . }} }}
+    UNION
+    {{ ?s skos:inScheme <{concept_scheme_uri}> ; ?p ?o . }}
+}}
+ORDER BY ?s ?p ?o
+LIMIT {limit} OFFSET {offset}'''.format(concept_scheme_uri=g.VOCABS[self.vocab_id].concept_scheme_uri, limit=limit,
+                                        offset=offset)
+
+    @staticmethod
+    def _ntriples_term(binding):
+        # a SPARQL JSON results binding, other than a blank node, as an N-Triples term
+        if binding['type'] == 'uri':
+            return '<{}>'.format(binding['value'])
+        literal = '"{}"'.format(binding['value'].replace('\\', '\\\\').replace('"', '\\"')
+                                .replace('\n', '\\n').replace('\r', '\\r'))
+        if binding.get('xml:lang'):
+            return '{}@{}'.format(literal, binding['xml:lang'])
+        if binding.get('datatype'):
+            return '{}^^<{}>'.format(literal, binding['datatype'])
+        return literal
+
+    @staticmethod
+    def collect_concept_labels(vocab):
+        """
+        Gets the labels and definitions of all the concepts of a vocab in every language, and their dates, for a
+        LabelStore, in pages of the vocab's hierarchy_page_size if it has one, ordered so that they neither overlap nor
+        leave gaps. Doesn't use the Flask globals, so may be called outside a request
+
+        :param vocab: the vocab
+        :type vocab: model.vocabulary.Vocabulary
+        :return: concept URI -> {'created': datetime, 'modified': datetime, <field>: {language: [value, ...]}} for the
+        LabelStore.FIELDS, language tags being lower-case and '' for no tag
+        :rtype: dict
+        """
+        def page_query(limit=None, offset=0):
+            return '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+PREFIX dct: <http://purl.org/dc/terms/>
+SELECT ?c ?p ?o
+WHERE {{
+    {{ GRAPH ?g {{
+        ?c skos:inScheme <{concept_scheme_uri}> .
+        ?c ?p ?o .
+        FILTER(?p IN (skos:prefLabel, skos:altLabel, skos:hiddenLabel, skos:definition, dct:created, dct:modified))
+    }} }}
+    UNION
+    {{
+        ?c skos:inScheme <{concept_scheme_uri}> .
+        ?c ?p ?o .
+        FILTER(?p IN (skos:prefLabel, skos:altLabel, skos:hiddenLabel, skos:definition, dct:created, dct:modified))
+    }}
+}}
+{page}'''.format(concept_scheme_uri=vocab.concept_scheme_uri,
+                  page='ORDER BY ?c ?p ?o LIMIT {} OFFSET {}'.format(limit, offset) if limit else '')
+
+        rows = Source.sparql_query_pages(vocab.sparql_endpoint, page_query, getattr(vocab, 'hierarchy_page_size', None),
+                                         vocab.sparql_username, vocab.sparql_password, use_cache=False)
+        assert rows is not None, 'Unable to query concept labels for {}'.format(vocab.id)
+
+        skos = 'http://www.w3.org/2004/02/skos/core#'
+        dct = 'http://purl.org/dc/terms/'
+        concepts = OrderedDict()
+        for row in rows:
+            fields = concepts.setdefault(row['c']['value'], {})
+            predicate = row['p']['value']
+            if predicate.startswith(skos):
+                values = fields.setdefault(predicate[len(skos):], {}).setdefault(row['o'].get('xml:lang', '').lower(), [])
+                if row['o']['value'] not in values:
+                    values.append(row['o']['value'])
+            elif predicate.startswith(dct) and predicate[len(dct):] not in fields:
+                fields[predicate[len(dct):]] = dateutil.parser.parse(row['o']['value'])
+        return concepts
 
     def get_vocabulary(self):
         """
@@ -123,10 +384,40 @@ ORDER BY ?pl'''.format(concept_scheme_uri=vocab.concept_scheme_uri,
         :return:
         :rtype:
         """
-        vocab = g.VOCABS[self.vocab_id]
+        # copy the registry's Vocabulary so that this request's additions aren't shared with other requests
+        vocab = copy(g.VOCABS[self.vocab_id])
+
+        hierarchy = self.read_cached_concept_hierarchy()
+        if hierarchy is not None:
+            vocab.hasTopConcept = self.get_top_concepts()
+            vocab.concept_hierarchy = self._draw_concept_hierarchy(hierarchy)
+        elif self.is_large_concept_hierarchy():
+            # only the top level would be shown, so don't build the whole hierarchy for it; /narrowers queries for each
+            # concept's narrowers as it is expanded
+            top_concepts, top_level = Source.sparql_queries(
+                vocab.sparql_endpoint,
+                [self._top_concepts_query(), self._concept_narrowers_query()],
+                vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id
+            )
+            assert top_level is not None, 'SPARQL concept hierarchy top level query failed'
+
+            vocab.hasTopConcept = self.get_top_concepts(top_concepts)
+            concepts = self._concept_narrowers(top_level)
+            with_narrowers = set(concept for concept, _, count in concepts if count)
+            vocab.concept_hierarchy = Source.draw_lazy_concept_hierarchy(
+                [(concept, preflabel) for concept, preflabel, _ in concepts],
+                lambda concept: concept in with_narrowers, self.request, self.vocab_id)
+        else:
+            # the top concepts and hierarchy queries are independent, so make them at the same time
+            top_concepts, bindings_list = Source.sparql_queries(
+                vocab.sparql_endpoint,
+                [self._top_concepts_query(), self._concept_hierarchy_query()],
+                vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id
+            )
+            bindings_list = self._hierarchy_in_fallback_language(bindings_list)
 
-        vocab.hasTopConcept = self.get_top_concepts()
-        vocab.concept_hierarchy = self.get_concept_hierarchy()
+            vocab.hasTopConcept = self.get_top_concepts(top_concepts, bindings_list)
+            vocab.concept_hierarchy = self.get_concept_hierarchy(bindings_list)
         vocab.source = self
         return vocab
 
@@ -136,40 +427,32 @@ ORDER BY ?pl'''.format(concept_scheme_uri=vocab.concept_scheme_uri,
 SELECT DISTINCT *
 WHERE {{ 
     {{ GRAPH ?g {{
-        {{ <{collection_uri}> (rdfs:label | skos:prefLabel) ?l .
-        FILTER(lang(?l) = "{language}" || lang(?l) = "") }}
-        OPTIONAL {{?s rdfs:comment ?c .
-        FILTER(lang(?c) = "{language}" || lang(?c) = "") }}
+        {{ <{collection_uri}> (rdfs:label | skos:prefLabel) ?l . }}
+        OPTIONAL {{ <{collection_uri}> rdfs:comment ?c . }}
     }} }}
     UNION
     {{
-        {{ <{collection_uri}> (rdfs:label | skos:prefLabel) ?l .
-        FILTER(lang(?l) = "{language}" || lang(?l) = "") }}
-        OPTIONAL {{?s rdfs:comment ?c .
-        FILTER(lang(?c) = "{language}" || lang(?c) = "") }}
+        {{ <{collection_uri}> (rdfs:label | skos:prefLabel) ?l . }}
+        OPTIONAL {{ <{collection_uri}> rdfs:comment ?c . }}
     }}
-}}'''.format(collection_uri=uri, 
-                language=self.language)
-        metadata = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
+}}'''.format(collection_uri=uri)
+        metadata = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
+        metadata = self._in_fallback_language(self._in_fallback_language(metadata, lambda x: None, 'l'),
+                                              lambda x: None, 'c')
 
         # get the collection's members
         q = '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 SELECT DISTINCT *
 WHERE {{
     {{ GRAPH ?g {{
-        <{}> skos:member ?m .
-        {{ ?n skos:prefLabel ?pl .
-        FILTER(lang(?pl) = "{language}" || lang(?pl) = "") }}
+        <{collection_uri}> skos:member ?m .
     }} }}
     UNION
     {{
-        <{}> skos:member ?m .
-        {{ ?n skos:prefLabel ?pl .
-        FILTER(lang(?pl) = "{language}" || lang(?pl) = "") }}
+        <{collection_uri}> skos:member ?m .
     }}
-}}'''.format(collection_uri=uri, 
-                            language=self.language)
-        members = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
+}}'''.format(collection_uri=uri)
+        members = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
 
         from model.collection import Collection
         return Collection(
@@ -180,10 +463,25 @@ WHERE {{
             [(x.get('m').get('value'), x.get('m').get('value')) for x in members]
         )
 
-    def get_concept(self):
-        concept_uri=self.request.values.get('uri')
+    def get_object_properties(self):
+        '''
+        Function to get all the properties of the requested object, including its rdf:type, in a single query, so that
+        both get_object_class() and get_concept() can be answered from the one result. Only a Concept's properties are
+        needed, so of any other object only its rdf:type is got, as from get_object_class()'s own query
+        '''
         vocab = g.VOCABS[self.vocab_id]
-        q = """PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        result = Source.sparql_query(vocab.sparql_endpoint, self._object_properties_query(), vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
+        assert result is not None, 'SPARQL object properties query failed'
+        # the labels of the objects, and then of the predicates, in the first language of the fallback chain
+        result = self._in_fallback_language(
+            result, lambda row: (row['predicate']['value'], row['object']['value'], row['object'].get('xml:lang')),
+            'objectLabel')
+        return self._in_fallback_language(result, lambda row: row['predicate']['value'], 'predicateLabel')
+
+    def _object_properties_query(self):
+        concept_uri=url_decode(self.request.values.get('uri'))
+        return """PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
 PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 PREFIX dct: <http://purl.org/dc/terms/>
 
@@ -192,33 +490,44 @@ select *
 WHERE {{
     {{ GRAPH ?graph {{
         <{concept_uri}> ?predicate ?object .
+        FILTER(?predicate = rdf:type || EXISTS {{
+            {{ GRAPH ?conceptGraph {{ <{concept_uri}> a skos:Concept . }} }} UNION {{ <{concept_uri}> a skos:Concept . }}
+            }})
         optional {{GRAPH ?predicateGraph {{?predicate rdfs:label ?predicateLabel .}} 
-            FILTER(lang(?predicateLabel) = "{language}" || lang(?predicateLabel) = "")
             }}
         optional {{?object skos:prefLabel | rdfs:label ?objectLabel .
-            FILTER(?prefLabel = skos:prefLabel || lang(?objectLabel) = "{language}" || lang(?objectLabel) = "") # Don't filter prefLabel language
         }}
     }} }}
     UNION
     {{
         <{concept_uri}> ?predicate ?object .
+        FILTER(?predicate = rdf:type || EXISTS {{
+            {{ GRAPH ?conceptGraph {{ <{concept_uri}> a skos:Concept . }} }} UNION {{ <{concept_uri}> a skos:Concept . }}
+            }})
         optional {{GRAPH ?predicateGraph {{?predicate rdfs:label ?predicateLabel .}} 
-            FILTER(lang(?predicateLabel) = "{language}" || lang(?predicateLabel) = "")
             }}
         optional {{?object skos:prefLabel | rdfs:label ?objectLabel .
-            FILTER(?prefLabel = skos:prefLabel || lang(?objectLabel) = "{language}" || lang(?objectLabel) = "") # Don't filter prefLabel language
         }}
     }}
-}}""".format(concept_uri=concept_uri, 
-             language=self.language)   
-        #print(q)
-        result = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
+}}""".format(concept_uri=concept_uri)
+
+    def get_concept(self, object_properties=None):
+        '''
+        object_properties may be given if get_object_properties() has already been called
+        '''
+        concept_uri=self.request.values.get('uri')
+        result = object_properties if object_properties is not None else self.get_object_properties()
         
         assert result, 'Unable to query concepts for {}'.format(self.request.values.get('uri'))
         
         #print(str(result).encode('utf-8'))
 
-        prefLabel = None
+        # the prefLabel in the first language of the fallback chain that the concept has one in
+        preflabels = self._in_fallback_language(
+            [row for row in result if row['predicate']['value'] == 'http://www.w3.org/2004/02/skos/core#prefLabel'],
+            lambda row: None, 'object')
+        prefLabel = preflabels[0]['object']['value'] if preflabels else None
+        prefLabel_lang = preflabels[0]['object'].get('xml:lang') if preflabels else None
         
         related_objects = {}
         
@@ -230,14 +539,8 @@ WHERE {{
                 predicateLabel = 'Multilingual Labels'
                 preflabel_lang = row['object'].get('xml:lang')
                 
-                # Use default language or no language prefLabel as primary
-                if ((not prefLabel and not preflabel_lang) or 
-                    (preflabel_lang == self.language)
-                    ):
-                    prefLabel = row['object']['value'] # Set current language prefLabel
-                    
                 # Omit current language string from list (remove this if we want to show all)
-                if preflabel_lang in ['', self.language]:
+                if preflabel_lang in ['', None, prefLabel_lang]:
                     continue
                     
                 # Apend language code to prefLabel literal
@@ -285,48 +588,186 @@ WHERE {{
         )
 
 
-    def get_concept_hierarchy(self):
+    def get_concept_hierarchy(self, bindings_list=None):
         '''
         Function to draw concept hierarchy for vocabulary
+        bindings_list may be given if the _concept_hierarchy_query() has already been made. Otherwise the hierarchy is
+        read from the hierarchy cache, if it is there, and only queried for and built if it is not
         '''
-        def build_hierarchy(bindings_list, broader_concept=None, level=0):
-            '''
-            Recursive helper function to build hierarchy list from a bindings list
-            Returns list of tuples: (<level>, <concept>, <concept_preflabel>, <broader_concept>)
-            '''
-            level += 1 # Start with level 1 for top concepts
-            hierarchy = []
-            
-            narrower_list = sorted([binding_dict 
-                                    for binding_dict in bindings_list
-                                    if 
-                                        # Top concept
-                                        ((broader_concept is None) 
-                                         and (binding_dict.get('broader_concept') is None))
-                                    or 
-                                        # Narrower concept
-                                        ((binding_dict.get('broader_concept') is not None) 
-                                         and (binding_dict['broader_concept']['value'] == broader_concept))
-                             ], key=lambda binding_dict: binding_dict['concept_preflabel']['value']) 
-            #print(broader_concept, narrower_list)
-            for binding_dict in narrower_list: 
-                concept = binding_dict['concept']['value']              
-                hierarchy += [(level,
-                               concept,
-                               binding_dict['concept_preflabel']['value'],
-                               binding_dict['broader_concept']['value'] if binding_dict.get('broader_concept') else None,
-                               )
-                              ] + build_hierarchy(bindings_list, concept, level)
-            #print(level, hierarchy)
-            return hierarchy
-        
-        
+        return self._draw_concept_hierarchy(self.get_concept_hierarchy_list(bindings_list))
+
+    def get_concept_hierarchy_list(self, bindings_list=None):
+        '''
+        Function to get the concept hierarchy for vocabulary as a list of (<level>, <concept>, <concept_preflabel>,
+        <broader_concept>) tuples, from the hierarchy cache or, if bindings_list is given or it isn't cached, by building it
+        '''
+        hierarchy = self.read_cached_concept_hierarchy() if bindings_list is None else None
+        if hierarchy is None:
+            if bindings_list is None:
+                bindings_list = self.get_concept_hierarchy_bindings()
+            #print(bindings_list)
+            assert bindings_list is not None, 'SPARQL concept hierarchy query failed'
+
+            hierarchy = build_hierarchy(bindings_list)
+            self.write_cached_concept_hierarchy(hierarchy)
+            h.cache_store.set(Source._hierarchy_size_key(self.vocab_id), len(hierarchy))
+        #print(hierarchy)
+
+        return hierarchy
+
+    def _draw_concept_hierarchy(self, hierarchy):
+        return Source.draw_concept_hierarchy(hierarchy, self.request, self.vocab_id,
+                                             narrowers=self.get_concept_narrowers_index(hierarchy))
+
+    def get_concept_narrowers_index(self, hierarchy=None):
+        '''
+        Function to get the vocab's concept hierarchy in this Source's language indexed by broader concept, as from
+        hierarchy_narrowers(). The index is kept in memory, for the vocab's current version, so that expanding a
+        concept in a lazily loaded hierarchy is a lookup. hierarchy may be given if the list has already been got
+        '''
+        return self._get_hierarchy_index('narrowers', hierarchy_narrowers, hierarchy)
+
+    def get_concept_closure(self, hierarchy=None):
+        '''
+        Function to get the transitive closure of the vocab's concept hierarchy in this Source's language, as a
+        HierarchyClosure, kept in memory for the vocab's current version like get_concept_narrowers_index()
+        '''
+        return self._get_hierarchy_index('closure', HierarchyClosure, hierarchy)
+
+    def _get_hierarchy_index(self, kind, build_index, hierarchy=None):
+        key = self._hierarchy_index_key(kind)
+        index = Source.hierarchy_index_cache.get(key)
+        if index is None:
+            index = build_index(hierarchy if hierarchy is not None else self.get_concept_hierarchy_list())
+            Source.hierarchy_index_cache.set(key, index, tag=self.vocab_id)
+        return index
+
+    def _hierarchy_index_key(self, kind):
+        return kind, self.vocab_id, self.language, Source.vocab_version(g.VOCABS[self.vocab_id])
+
+    def get_concept_narrowers(self, uri=None):
+        '''
+        Function to list the narrowers of a concept in the concept hierarchy, or the top concepts if no uri is given
+        Returns a list of (<concept>, <concept_preflabel>, <number of narrowers>) tuples in display order. They are
+        looked up in the narrowers index if the hierarchy is already cached, and otherwise only the concept's own
+        narrowers are queried for, so that expanding a concept of a large hierarchy doesn't build all of it
+        '''
+        narrowers = Source.hierarchy_index_cache.get(self._hierarchy_index_key('narrowers'))
+        if narrowers is None:
+            hierarchy = self.read_cached_concept_hierarchy()
+            if hierarchy is not None:
+                narrowers = self.get_concept_narrowers_index(hierarchy)
+        if narrowers is not None:
+            return [(concept, preflabel, len(narrowers.get(concept, ())))
+                    for concept, preflabel in narrowers.get(uri, {}).items()]
+
+        vocab = g.VOCABS[self.vocab_id]
+        bindings = Source.sparql_query(vocab.sparql_endpoint, self._concept_narrowers_query(uri), vocab.sparql_username,
+                                       vocab.sparql_password, vocab_id=self.vocab_id)
+        assert bindings is not None, 'SPARQL concept narrowers query failed'
+        return self._concept_narrowers(bindings)
+
+    def _concept_narrowers(self, bindings):
+        # the _concept_narrowers_query() bindings as get_concept_narrowers() gives them, with each concept's prefLabel
+        # in the first language of the fallback chain
+        concepts = OrderedDict()
+        for binding in self._in_fallback_language(bindings, lambda binding: binding['concept']['value'],
+                                                  'concept_preflabel'):
+            concepts.setdefault(binding['concept']['value'], (binding['concept_preflabel']['value'],
+                                                              int(binding['narrowers']['value'])))
+        return [(concept, preflabel, count) for concept, (preflabel, count) in concepts.items()]
+
+    def read_cached_concept_hierarchy(self):
+        '''
+        Function to get the vocab's concept hierarchy list in this Source's language from the hierarchy cache
+        Returns None if it isn't cached or was cached for a different modified date or versionInfo of the vocab
+        '''
+        version = Source.vocab_version(g.VOCABS[self.vocab_id])
+        cached = h.cache_store.get(Source._hierarchy_cache_key(self.vocab_id),
+                                   max_age=Source.version_cache_max_age(version))
+        if cached is None or cached['version'] != version:
+            return None
+        return cached['languages'].get(self.language)
+
+    def write_cached_concept_hierarchy(self, hierarchy):
+        '''
+        Function to store the vocab's concept hierarchy list in this Source's language in the hierarchy cache, alongside
+        any other languages already cached for the same version of the vocab
+        '''
+        version = Source.vocab_version(g.VOCABS[self.vocab_id])
+        key = Source._hierarchy_cache_key(self.vocab_id)
+        cached = h.cache_store.get(key, max_age=Source.version_cache_max_age(version))
+        if cached is None or cached['version'] != version:
+            cached = {'version': version, 'languages': {}}
+        cached['languages'][self.language] = hierarchy
+        h.cache_store.set(key, cached)
+
+    @staticmethod
+    def purge_concept_hierarchy(vocab_id):
+        '''
+        Function to remove a vocab's concept hierarchies, in all languages, from the hierarchy cache
+        '''
+        h.cache_store.delete(Source._hierarchy_cache_key(vocab_id))
+
+    @staticmethod
+    def _hierarchy_cache_key(vocab_id):
+        return Source.HIERARCHY_CACHE_FILE_NAME.format(re.sub(r'[^\w.-]', '_', vocab_id))
+
+    @staticmethod
+    def _hierarchy_size_key(vocab_id):
+        return Source.HIERARCHY_SIZE_FILE_NAME.format(re.sub(r'[^\w.-]', '_', vocab_id))
+
+    @staticmethod
+    def vocab_version(vocab):
+        return (vocab.modified, vocab.versionInfo)
+
+    @staticmethod
+    def version_cache_max_age(version):
+        # without a modified date or versionInfo a change to the vocab can't be seen, so let it age out instead
+        return config.VOCAB_CACHE_HOURS * 3600 if version == (None, None) else None
+
+    def is_large_concept_hierarchy(self):
+        '''
+        Function to tell, without building it, whether the vocab's concept hierarchy is long enough for only its top
+        level to be shown, as draw_concept_hierarchy() does with HIERARCHY_LAZY_LOAD_CONCEPTS or more items. A vocab with
+        a hierarchy_page_size is taken to be, as is one whose hierarchy, as last built by any worker process for this or
+        an earlier version of the vocab, was
+        '''
+        lazy_load_concepts = getattr(config, 'HIERARCHY_LAZY_LOAD_CONCEPTS', 1000)
+        if not lazy_load_concepts:
+            return False
+        if getattr(g.VOCABS[self.vocab_id], 'hierarchy_page_size', None):
+            return True
+        return (h.cache_store.get(Source._hierarchy_size_key(self.vocab_id)) or 0) >= lazy_load_concepts
+
+    def get_concept_hierarchy_bindings(self):
+        '''
+        Function to make the _concept_hierarchy_query() for vocabulary. If the vocab has a hierarchy_page_size, set from
+        its source's details in VOCAB_SOURCES, the bindings are fetched in pages of that many, ordered by all of their
+        variables so that the pages neither overlap nor leave gaps. Duplicates are dropped and the hierarchy ordered by
+        prefLabel when it is built. Returns None if a query fails
+        '''
+        vocab = g.VOCABS[self.vocab_id]
+        return self._hierarchy_in_fallback_language(Source.sparql_query_pages(
+            vocab.sparql_endpoint, self._concept_hierarchy_query,
+            getattr(vocab, 'hierarchy_page_size', None),  # not set on vocabs cached before it was added
+            vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id))
+
+    def _hierarchy_in_fallback_language(self, bindings_list):
+        # the _concept_hierarchy_query() gives each concept's prefLabels in every language, so that it is shared by all
+        # languages: keep those in the first language of the fallback chain, or None if the query failed
+        if bindings_list is None:
+            return None
+        return self._in_fallback_language(bindings_list, lambda binding: binding['concept']['value'],
+                                          'concept_preflabel')
+
+    def _concept_hierarchy_query(self, limit=None, offset=0):
         vocab = g.VOCABS[self.vocab_id]
                  
-        query = '''PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        return '''PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
 PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 PREFIX dct: <http://purl.org/dc/terms/>
-SELECT distinct ?concept ?concept_preflabel ?broader_concept
+SELECT {distinct}?concept ?concept_preflabel ?broader_concept
 WHERE {{
     {{ GRAPH ?graph {{
         ?concept skos:inScheme <{vocab_uri}> .
@@ -334,7 +775,6 @@ WHERE {{
         OPTIONAL {{ ?concept skos:broader ?broader_concept .
             ?broader_concept skos:inScheme <{vocab_uri}> .
             }}
-        FILTER(lang(?concept_preflabel) = "{language}" || lang(?concept_preflabel) = "")
     }} }}
     UNION
     {{
@@ -343,22 +783,60 @@ WHERE {{
         OPTIONAL {{ ?concept skos:broader ?broader_concept .
             ?broader_concept skos:inScheme <{vocab_uri}> .
             }}
-        FILTER(lang(?concept_preflabel) = "{language}" || lang(?concept_preflabel) = "")
     }}
 }}
-ORDER BY ?concept_preflabel'''.format(vocab_uri=vocab.concept_scheme_uri, language=self.language)
-        #print(query)
-        bindings_list = Source.sparql_query(vocab.sparql_endpoint, query, vocab.sparql_username, vocab.sparql_password)
-        #print(bindings_list)
-        assert bindings_list is not None, 'SPARQL concept hierarchy query failed'
-         
-        hierarchy = build_hierarchy(bindings_list)
-        #print(hierarchy)
- 
-        return Source.draw_concept_hierarchy(hierarchy, self.request, self.vocab_id)
+{order_or_page}'''.format(vocab_uri=vocab.concept_scheme_uri,
+                          distinct='' if limit else 'distinct ',
+                          order_or_page='ORDER BY ?concept ?broader_concept ?concept_preflabel LIMIT {} OFFSET {}'.format(
+                              limit, offset) if limit else 'ORDER BY ?concept_preflabel')
 
+    def _concept_narrowers_query(self, uri=None):
+        # the concepts that _concept_hierarchy_query() gives uri as the broader_concept of, or no broader_concept if uri
+        # is None, and how many concepts have each of them as their broader_concept
+        vocab = g.VOCABS[self.vocab_id]
+        if uri is None:
+            broader = '''FILTER NOT EXISTS {{ ?concept skos:broader ?broader_concept .
+            ?broader_concept skos:inScheme <{vocab_uri}> .
+            }}'''.format(vocab_uri=vocab.concept_scheme_uri)
+        else:
+            broader = '?concept skos:broader <{}> .'.format(uri)
+        return '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+SELECT ?concept ?concept_preflabel (COUNT(DISTINCT ?narrower_concept) AS ?narrowers)
+WHERE {{
+    {{ GRAPH ?graph {{
+        ?concept skos:inScheme <{vocab_uri}> .
+        ?concept skos:prefLabel ?concept_preflabel .
+        {broader}
+        OPTIONAL {{ ?narrower_concept skos:broader ?concept .
+            ?narrower_concept skos:inScheme <{vocab_uri}> .
+            }}
+    }} }}
+    UNION
+    {{
+        ?concept skos:inScheme <{vocab_uri}> .
+        ?concept skos:prefLabel ?concept_preflabel .
+        {broader}
+        OPTIONAL {{ ?narrower_concept skos:broader ?concept .
+            ?narrower_concept skos:inScheme <{vocab_uri}> .
+            }}
+    }}
+}}
+GROUP BY ?concept ?concept_preflabel
+ORDER BY ?concept_preflabel ?concept'''.format(vocab_uri=vocab.concept_scheme_uri, broader=broader)
+
+    def get_object_class(self, object_properties=None):
+        '''
+        Function to get the SKOS class of the requested object, from object_properties if get_object_properties() has
+        already been called
+        '''
+        if object_properties is not None:
+            clses = [row['object']['value'] for row in object_properties
+                     if row['predicate']['value'] == 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type']
+            for cls in clses:
+                if cls in Source.VOC_TYPES:
+                    return cls
+            return None
 
-    def get_object_class(self):
         #print('get_object_class uri = {}'.format(url_decode(self.request.values.get('uri'))))
         vocab = g.VOCABS[self.vocab_id]
         q = '''SELECT DISTINCT * 
@@ -371,7 +849,7 @@ WHERE {{
         <{uri}> a ?c .
     }}
 }}'''.format(uri=url_decode(self.request.values.get('uri')))
-        clses = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
+        clses = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
         assert clses is not None, 'SPARQL class query failed'
         #print(clses)
         # look for classes we understand (SKOS)
@@ -388,128 +866,156 @@ WHERE {{
     @staticmethod
     def get_narrowers(uri, depth):
         """
-        Recursively get all skos:narrower properties as a list.
+        Get all the concepts under a concept as a list, following skos:broader back to each concept from the Turtle of
+        its narrowers at <narrower URI>.ttl, as crawled by crawl_narrowers().
 
         :param uri: URI node
         :param depth: The current depth
-        :param g: The graph
         :return: list of tuples(tree_depth, uri, prefLabel)
         :rtype: list
         """
-        depth += 1
-
-        # Some RVA sources won't load on first try, so ..
-        # if failed, try load again.
-        g = None
-        max_attempts = 10
-        for i in range(max_attempts):
-            try:
-                g = Graph().parse(uri + '.ttl', format='turtle')
-                break
-            except:
-                logging.warning('Failed to load resource at URI {}. Attempt: {}.'.format(uri, i+1))
-        if not g:
-            raise Exception('Failed to load Graph from {}. Maximum attempts exceeded {}.'.format(uri, max_attempts))
-
-        items = []
-        for s, p, o in g.triples((None, SKOS.broader, URIRef(uri))):
-            items.append((depth, str(s), Source.get_prefLabel_from_uri(s)))
-        items.sort(key=lambda x: x[2])
-        count = 0
-        for item in items:
-            count += 1
-            new_items = Source.get_narrowers(item[1], item[0])
-            items = items[:count] + new_items + items[count:]
-            count += len(new_items)
-        return items
+        narrowers = Source.crawl_narrowers(uri)
+
+        # build_hierarchy() orders the concepts by label, depth first, and stops at any cycle
+        bindings_list = []
+        for broader, concepts in narrowers.items():
+            for concept in concepts:
+                binding_dict = {'concept': {'value': concept},
+                                'concept_preflabel': {'value': Source.get_prefLabel_from_uri(concept)}}
+                if broader != uri:
+                    binding_dict['broader_concept'] = {'value': broader}
+                bindings_list.append(binding_dict)
+
+        return [(level + depth, concept, preflabel) for level, concept, preflabel, _broader in build_hierarchy(bindings_list)]
 
     @staticmethod
-    def draw_concept_hierarchy(hierarchy, request, vocab_id):
-        tab = '\t'
-        previous_length = 1
-
-        text = ''
-        tracked_items = []
-        for item in hierarchy:
-            mult = None
-
-            if item[0] > previous_length + 2: # SPARQL query error on length value
-                for tracked_item in tracked_items:
-                    if tracked_item['name'] == item[3]:
-                        mult = tracked_item['indent'] + 1
-
-            if mult is None:
-                found = False
-                for tracked_item in tracked_items:
-                    if tracked_item['name'] == item[3]:
-                        found = True
-                if not found:
-                    mult = 0
-
-            if mult is None: # else: # everything is normal
-                mult = item[0] - 1
-
-            # Default to showing local URLs unless told otherwise
-            if (not hasattr(config, 'LOCAL_URLS')) or config.LOCAL_URLS:
-                uri = request.url_root + 'object?vocab_id=' + vocab_id + '&uri=' + h.url_encode(item[1])
-            else:
-                uri = item[1]
+    def crawl_narrowers(uri):
+        """
+        Crawls the concepts under a concept breadth-first, fetching each level's Turtle documents in parallel, with up to
+        NARROWERS_CRAWL_WORKERS at a time, and each concept's only once however many broaders it has.
+
+        :param uri: URI node
+        :return: the URIs of the narrowers of the concept and of each concept under it, keyed by concept URI
+        :rtype: dict
+        """
+        narrowers = {}
+        frontier = [uri]
+        while frontier:
+            for concept, concept_narrowers in zip(frontier, Source.crawl_executor.map(Source._fetch_narrowers, frontier)):
+                narrowers[concept] = concept_narrowers
+            frontier = list(OrderedDict.fromkeys(
+                narrower for concept in frontier for narrower in narrowers[concept] if narrower not in narrowers
+            ))
+        return narrowers
+
+    @staticmethod
+    def _fetch_narrowers(uri):
+        """
+        Gets the URIs of the concepts that have uri as their skos:broader in the Turtle at <uri>.ttl. Responses are kept
+        in the cache store, reused for VOCAB_CACHE_HOURS and then revalidated with a conditional request.
+
+        :param uri: URI node
+        :return: the narrowers' URIs
+        :rtype: list
+        """
+        key = 'NARROWERS_{}.p'.format(hashlib.sha256(uri.encode('utf-8')).hexdigest())
+        cached = h.cache_store.get(key)
+        if cached is not None and h.cache_age(key) <= config.VOCAB_CACHE_HOURS * 3600:
+            return cached['narrowers']
+
+        # Some RVA sources won't load on first try, so http_pool retries failed requests
+        headers = {'Accept': 'text/turtle'}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        r = http_pool.get(uri + '.ttl', headers=headers, timeout=config.SPARQL_TIMEOUT)
+
+        if r.status_code == 304 and cached is not None:
+            narrowers = cached['narrowers']
+        elif r.status_code == 200:
+            g = Graph().parse(data=r.text, format='turtle', publicID=uri + '.ttl')
+            narrowers = [str(s) for s in g.subjects(SKOS.broader, URIRef(uri))]
+            cached = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+        else:
+            raise Exception('Failed to load Graph from {}. Status code {}.'.format(uri, r.status_code))
+
+        cached['narrowers'] = narrowers
+        h.cache_store.set(key, cached)  # also restarts its age
+        return narrowers
+
+    @staticmethod
+    def draw_concept_hierarchy(hierarchy, request, vocab_id, narrowers=None):
+        '''
+        Function to render a concept hierarchy list as HTML. A hierarchy of HIERARCHY_LAZY_LOAD_CONCEPTS or more items
+        only has its top concepts rendered, with their narrowers loaded from /vocabulary/<vocab_id>/narrowers as they
+        are expanded. narrowers may be given if the hierarchy_narrowers() index of the hierarchy has already been made
+        '''
+        def concept_url(uri):
+            return Source.get_object_url(request, vocab_id, uri)
+
+        lazy_load_concepts = getattr(config, 'HIERARCHY_LAZY_LOAD_CONCEPTS', 1000)
+        if lazy_load_concepts and len(hierarchy) >= lazy_load_concepts:
+            if narrowers is None:
+                narrowers = hierarchy_narrowers(hierarchy)
+            return Source.draw_lazy_concept_hierarchy(narrowers.get(None, {}).items(),
+                                                      lambda concept: bool(narrowers.get(concept)), request, vocab_id)
+
+        return Markup(render_hierarchy_html(hierarchy, concept_url))
+
+    @staticmethod
+    def draw_lazy_concept_hierarchy(top_concepts, has_narrowers, request, vocab_id):
+        '''
+        Function to render only the top level of a concept hierarchy as HTML, given as (<concept>, <concept_preflabel>)
+        pairs, with the narrowers of those for which has_narrowers(concept) is true loaded from
+        /vocabulary/<vocab_id>/narrowers as they are expanded
+        '''
+        language = request.values.get('lang')
+
+        def concept_url(uri):
+            return Source.get_object_url(request, vocab_id, uri)
 
-            t = tab * mult + '* [' + item[2] + '](' + uri + ')\n'
-            text += t
-            previous_length = mult
-            tracked_items.append({'name': item[1], 'indent': mult})
+        def narrowers_url(uri):
+            return request.url_root + 'vocabulary/' + h.url_encode(vocab_id) + '/narrowers?' + \
+                ('lang=' + h.url_encode(language) + '&' if language else '') + 'uri=' + h.url_encode(uri)
 
-        return markdown.markdown(text)
+        return Markup(render_lazy_hierarchy_html(top_concepts, has_narrowers, concept_url, narrowers_url))
 
-    def get_top_concepts(self):
+    @staticmethod
+    def get_object_url(request, vocab_id, uri):
+        # Default to showing local URLs unless told otherwise
+        if (not hasattr(config, 'LOCAL_URLS')) or config.LOCAL_URLS:
+            return request.url_root + 'object?vocab_id=' + vocab_id + '&uri=' + h.url_encode(uri)
+        return uri
+
+    def get_top_concepts(self, top_concepts=None, concept_bindings=None):
+        '''
+        Function to list the top concepts of the vocabulary, as (URI, prefLabel) tuples
+        top_concepts may be given if the _top_concepts_query() has already been made. If there are no top concepts, all
+        the concepts in the vocabulary are listed instead, taken from concept_bindings, the results of the
+        _concept_hierarchy_query(), if given
+        '''
         vocab = g.VOCABS[self.vocab_id]
-        q = '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
-SELECT DISTINCT ?tc ?pl
-WHERE {{
-    {{ GRAPH ?g 
-        {{
-            {{
-                <{concept_scheme_uri}> skos:hasTopConcept ?tc .                
-            }}
-            UNION 
-            {{
-                ?tc skos:topConceptOf <{concept_scheme_uri}> .
-            }}
-            {{ ?tc skos:prefLabel ?pl .
-                FILTER(lang(?pl) = "{language}" || lang(?pl) = "") 
-            }}
-        }}
-    }}
-    UNION
-    {{
-        {{
-            <{concept_scheme_uri}> skos:hasTopConcept ?tc .                
-        }}
-        UNION 
-        {{
-            ?tc skos:topConceptOf <{concept_scheme_uri}> .
-        }}
-        {{ ?tc skos:prefLabel ?pl .
-            FILTER(lang(?pl) = "{language}" || lang(?pl) = "")
-        }}
-    }}
-}}
-ORDER BY ?pl
-'''.format(concept_scheme_uri=vocab.concept_scheme_uri,
-                                   language=self.language)
-        top_concepts = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
+        if top_concepts is None:
+            top_concepts = Source.sparql_query(vocab.sparql_endpoint, self._top_concepts_query(), vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
         
         if top_concepts is not None:
             # cache prefLabels and do not add duplicates. This prevents Concepts with sameAs properties appearing twice
             pl_cache = []
             tcs = []
-            for tc in top_concepts:
+            for tc in self._in_fallback_language(top_concepts, lambda tc: tc['tc']['value'], 'pl'):
                 if tc.get('pl').get('value') not in pl_cache:  # only add if not already in cache
                     tcs.append((tc.get('tc').get('value'), tc.get('pl').get('value')))
                     pl_cache.append(tc.get('pl').get('value'))
 
-            if len(tcs) == 0:
+            if len(tcs) == 0 and concept_bindings is not None:
+                # the hierarchy query has already got every concept in the scheme
+                for c in sorted(concept_bindings, key=lambda c: c['concept_preflabel']['value']):
+                    if c['concept_preflabel']['value'] not in pl_cache:
+                        tcs.append((c['concept']['value'], c['concept_preflabel']['value']))
+                        pl_cache.append(c['concept_preflabel']['value'])
+            elif len(tcs) == 0:
                 q = '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
 SELECT DISTINCT ?tc ?pl
 WHERE {{
@@ -522,7 +1028,6 @@ WHERE {{
             ?tc skos:inScheme <{concept_scheme_uri}> .
         }}
         {{ ?tc skos:prefLabel ?pl .
-            FILTER(lang(?pl) = "{language}" || lang(?pl) = "") 
         }}
     }} }}
     UNION
@@ -535,16 +1040,14 @@ WHERE {{
             ?tc skos:inScheme <{concept_scheme_uri}> .
         }}
         {{ ?tc skos:prefLabel ?pl .
-            FILTER(lang(?pl) = "{language}" || lang(?pl) = "")
         }}
     }}
 }}
 ORDER BY ?pl
-'''.format(concept_scheme_uri=vocab.concept_scheme_uri,
-                                           language=self.language)
+'''.format(concept_scheme_uri=vocab.concept_scheme_uri)
                 #print(q)
-                top_concepts = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password)
-                for tc in top_concepts:
+                top_concepts = Source.sparql_query(vocab.sparql_endpoint, q, vocab.sparql_username, vocab.sparql_password, vocab_id=self.vocab_id)
+                for tc in self._in_fallback_language(top_concepts, lambda tc: tc['tc']['value'], 'pl'):
                     if tc.get('pl').get('value') not in pl_cache:  # only add if not already in cache
                         tcs.append((tc.get('tc').get('value'), tc.get('pl').get('value')))
                         pl_cache.append(tc.get('pl').get('value'))
@@ -553,22 +1056,180 @@ ORDER BY ?pl
         else:
             return None
 
+    def _top_concepts_query(self):
+        vocab = g.VOCABS[self.vocab_id]
+        return '''PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+SELECT DISTINCT ?tc ?pl
+WHERE {{
+    {{ GRAPH ?g 
+        {{
+            {{
+                <{concept_scheme_uri}> skos:hasTopConcept ?tc .                
+            }}
+            UNION 
+            {{
+                ?tc skos:topConceptOf <{concept_scheme_uri}> .
+            }}
+            {{ ?tc skos:prefLabel ?pl .
+                }}
+        }}
+    }}
+    UNION
+    {{
+        {{
+            <{concept_scheme_uri}> skos:hasTopConcept ?tc .                
+        }}
+        UNION 
+        {{
+            ?tc skos:topConceptOf <{concept_scheme_uri}> .
+        }}
+        {{ ?tc skos:prefLabel ?pl .
+        }}
+    }}
+}}
+ORDER BY ?pl
+'''.format(concept_scheme_uri=vocab.concept_scheme_uri)
+
     @staticmethod
-    def sparql_query(endpoint, q, sparql_username=None, sparql_password=None):
-        sparql = SPARQLWrapper(endpoint)
-        sparql.setQuery(q)
-        sparql.setReturnFormat(JSON)
-
-        if sparql_username and sparql_password:            
-            sparql.setHTTPAuth(BASIC)
-            sparql.setCredentials(sparql_username, sparql_password)
-            
+    def sparql_query(endpoint, q, sparql_username=None, sparql_password=None, vocab_id=None, use_cache=True):
+        """
+        Submits a SELECT query and returns its result bindings, or None if the query failed. Results are memoised in
+        Source.query_cache, keyed by endpoint, whitespace-normalised query and credentials, for
+        SPARQL_QUERY_CACHE_SECONDS; cached results are shared between requests so must not be modified.
+
+        :param vocab_id: the vocab the query is about, so its results can be dropped by Source.invalidate(vocab_id)
+        :param use_cache: False to always query the endpoint, e.g. when collecting vocabs
+        :return: list of bindings dicts
+        :rtype: list
+        """
+        if use_cache:
+            cache_key = Source._query_cache_key(endpoint, q, sparql_username, sparql_password)
+            result = Source.query_cache.get(cache_key)
+            if result is not None:
+                return result
+
         try:
-            return sparql.query().convert()['results']['bindings']
+            # query via POST with URL-encoded parameters, over the endpoint's pooled keep-alive connections
+            response = http_pool.post(endpoint,
+                                      data={'query': q},
+                                      headers={'Accept': 'application/sparql-results+json'},
+                                      auth=(sparql_username, sparql_password) if sparql_username and sparql_password else None,
+                                      timeout=config.SPARQL_TIMEOUT)
+            response.raise_for_status()
+            result = response.json()['results']['bindings']
         except Exception as e:
             logging.debug('SPARQL query failed: {}'.format(e))
             logging.debug('endpoint={}\nsparql_username={}\nsparql_password={}\n{}'.format(endpoint, sparql_username, sparql_password, q))
             return None
+
+        if use_cache:
+            Source.query_cache.set(cache_key, result, tag=vocab_id)
+        return result
+
+    @staticmethod
+    def sparql_queries(endpoint, queries, sparql_username=None, sparql_password=None, vocab_id=None):
+        """
+        Submits several independent SELECT queries to an endpoint at the same time, so that together they take about as
+        long as the slowest of them, using the threads of Source.query_executor
+
+        :return: the bindings list, or None, for each query in order
+        :rtype: list
+        """
+        futures = [Source.query_executor.submit(Source.sparql_query, endpoint, q, sparql_username, sparql_password,
+                                                vocab_id=vocab_id)
+                   for q in queries]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def sparql_query_pages(endpoint, page_query, page_size, sparql_username=None, sparql_password=None, vocab_id=None,
+                           use_cache=True):
+        """
+        Makes a SELECT query in pages of page_size results, one after another, or as a single query if page_size is None
+
+        :param page_query: function of (limit, offset) giving the query for a page, or for all results if limit is None
+        :return: the bindings of all the pages, or None if a query fails
+        :rtype: list
+        """
+        if not page_size:
+            return Source.sparql_query(endpoint, page_query(), sparql_username, sparql_password, vocab_id=vocab_id,
+                                       use_cache=use_cache)
+
+        bindings_list = []
+        offset = 0
+        while True:
+            page = Source.sparql_query(endpoint, page_query(page_size, offset), sparql_username, sparql_password,
+                                       vocab_id=vocab_id, use_cache=use_cache)
+            if page is None:
+                return None
+            bindings_list += page
+            if len(page) < page_size:
+                return bindings_list
+            offset += page_size
+
+    @staticmethod
+    def _query_cache_key(endpoint, q, sparql_username=None, sparql_password=None):
+        # identify credentials by a digest rather than keeping the password in the key
+        credentials = hashlib.sha256('{}:{}'.format(sparql_username, sparql_password).encode('utf-8')).hexdigest() \
+            if sparql_username and sparql_password else None
+        return endpoint, ' '.join(q.split()), credentials
+
+    @staticmethod
+    def invalidate(vocab_id=None):
+        """
+        Drops the memoised query results for a vocab, or for all vocabs if no vocab_id is given, and the vocab's cached
+        concept hierarchies
+        """
+        Source.query_cache.invalidate(vocab_id)
+        Source.hierarchy_index_cache.invalidate(vocab_id)
+        if vocab_id is not None:
+            Source.purge_concept_hierarchy(vocab_id)
+
+    @staticmethod
+    def purge(vocab_id):
+        """
+        Invalidates a vocab and leaves a purge marker in the cache store, so that the other worker processes drop their
+        memoised results for it too when they next check for one
+        :return: the generation of the purge
+        :rtype: float
+        """
+        generation = time.time()
+        h.cache_store.set(Source._purge_marker_key(vocab_id), {'generation': generation})
+        Source._purges_seen[vocab_id] = generation
+        Source._purges_applied[vocab_id] = generation
+        Source.invalidate(vocab_id)
+        return generation
+
+    @staticmethod
+    def purge_generation(vocab_id):
+        """
+        :return: the generation of the last purge of a vocab by any worker process, or 0 if it has never been purged,
+        reading its purge marker at most every PURGE_CHECK_SECONDS
+        :rtype: float
+        """
+        now = time.time()
+        if now - Source._purges_checked.get(vocab_id, 0) >= getattr(config, 'PURGE_CHECK_SECONDS', 5):
+            Source._purges_checked[vocab_id] = now
+            marker = h.cache_store.get(Source._purge_marker_key(vocab_id))
+            if marker is not None and marker['generation'] > Source._purges_seen.get(vocab_id, 0):
+                Source._purges_seen[vocab_id] = marker['generation']
+        return Source._purges_seen.get(vocab_id, 0)
+
+    @staticmethod
+    def apply_purge(vocab_id):
+        """
+        Drops this worker process's memoised results for a vocab if another worker process has purged it since they
+        were dropped last. The shared cached concept hierarchies were already removed by the purge itself.
+        :return: nothing
+        """
+        generation = Source.purge_generation(vocab_id)
+        if generation > Source._purges_applied.get(vocab_id, 0):
+            Source._purges_applied[vocab_id] = generation
+            Source.query_cache.invalidate(vocab_id)
+            Source.hierarchy_index_cache.invalidate(vocab_id)
+
+    @staticmethod
+    def _purge_marker_key(vocab_id):
+        return Source.PURGE_MARKER_FILE_NAME.format(re.sub(r'[^\w.-]', '_', vocab_id))
         
     
     @staticmethod
@@ -591,25 +1252,18 @@ ORDER BY ?pl
             
         params = None
         
-        retries = 0
-        while True:
-            try:
-                response = requests.post(endpoint, 
-                                       headers=headers, 
-                                       params=params, 
-                                       data=q, 
-                                       timeout=config.SPARQL_TIMEOUT)
-                #logging.debug('Response content: {}'.format(str(response.content)))
-                assert response.status_code == 200, 'Response status code {} != 200'.format(response.status_code)
-                return response.text
-            except Exception as e:
-                logging.warning('SPARQL query failed: {}'.format(e))
-                retries += 1
-                if retries <= config.MAX_RETRIES:
-                    sleep(config.RETRY_SLEEP_SECONDS)
-                    continue # Go around again
-                else:
-                    break
+        # retries, with backoff, and circuit breaking are done by the pool
+        try:
+            response = http_pool.post(endpoint,
+                                      headers=headers,
+                                      params=params,
+                                      data=q,
+                                      timeout=config.SPARQL_TIMEOUT)
+            #logging.debug('Response content: {}'.format(str(response.content)))
+            assert response.status_code == 200, 'Response status code {} != 200'.format(response.status_code)
+            return response.text
+        except Exception as e:
+            logging.warning('SPARQL query failed: {}'.format(e))
                 
         raise(BaseException('SPARQL query failed'))
 
@@ -3,34 +3,13 @@ import re
 from rdflib import URIRef
 import markdown
 import os
-import time
-import pickle
 import logging
-import errno
 import _config as config
-from bs4 import BeautifulSoup
+from data.cache import DiskCacheStore, MemoryCacheStore
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-def render_concept_tree(html_doc):
-    soup = BeautifulSoup(html_doc, 'html.parser')
-
-    #concept_hierarchy = soup.find(id='concept-hierarchy')
-
-    uls = soup.find_all('ul')
-
-    for i, ul in enumerate(uls):
-        # Don't add HTML class nested to the first 'ul' found.
-        if not i == 0:
-            ul['class'] = 'nested'
-            if ul.parent.name == 'li':
-                temp = BeautifulSoup(str(ul.parent.a.extract()), 'html.parser')
-                ul.parent.insert(0, BeautifulSoup('<span class="caret">', 'html.parser'))
-                ul.parent.span.insert(0, temp)
-    return soup
-
-
 def url_encode(s):
     try:
         return urllib.parse.quote(s)
@@ -100,32 +79,37 @@ def is_url(url):
         r'(?:/?|[/?]\S+)$', re.IGNORECASE)
     return True if re.search(pattern, url) is not None else False
 
-def cache_read(cache_file_name):
+def _make_cache_store():
+    '''
+    Function to make the cache store configured by VOCAB_CACHE_BACKEND ('disk', the default, or 'memory'), holding at
+    most VOCAB_CACHE_MAX_MB megabytes
+    '''
+    max_mb = getattr(config, 'VOCAB_CACHE_MAX_MB', None)
+    max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+    if getattr(config, 'VOCAB_CACHE_BACKEND', 'disk') == 'memory':
+        return MemoryCacheStore(max_bytes=max_bytes)
+    return DiskCacheStore(config.VOCAB_CACHE_DIR, max_bytes=max_bytes)
+
+
+cache_store = _make_cache_store()
+
+
+def cache_age(cache_file_name):
+    '''
+    Function to return the age of a cache file in seconds. Returns None if there is no such cache file
+    '''
+    return cache_store.age(cache_file_name)
+
+def cache_read(cache_file_name, ignore_age=False):
     '''
     Function to read object from cache if cache file is younger than cache_hours. Returns None on failure
+    If ignore_age is True, the cache file is read however old it is
     '''
-    cache_seconds = config.VOCAB_CACHE_HOURS * 3600
-    cache_file_path = os.path.join(config.VOCAB_CACHE_DIR, cache_file_name)
-    
-    if os.path.isfile(cache_file_path):
-        # if the cache file is younger than cache_hours days, then try to read it
-        cache_file_age = time.time() - os.stat(cache_file_path).st_mtime
-        logging.debug('Cache file age: {0:.2f} hours'.format(cache_file_age / 3600))
-        # if the cache file is older than VOCAB_CACHE_HOURS, ignore it
-        if cache_file_age <= cache_seconds:
-            try:
-                with open(cache_file_path, 'rb') as f:
-                    cache_object = pickle.load(f)
-                    f.close()
-                if cache_object: # Ignore empty file
-                    logging.debug('Read cache file {}'.format(os.path.abspath(cache_file_path)))
-                    return cache_object
-            except Exception as e:
-                logging.debug('Unable to read cache file {}: {}'.format(os.path.abspath(cache_file_path), e))
-                pass
-        else:
-            logging.debug('Ignoring old cache file {}'.format(os.path.abspath(cache_file_path)))
-        
+    cache_object = cache_store.get(cache_file_name, max_age=None if ignore_age else config.VOCAB_CACHE_HOURS * 3600)
+    if cache_object: # Ignore empty object
+        logging.debug('Read cache file {}'.format(cache_file_name))
+        return cache_object
+
     return
 
 def cache_write(cache_object, cache_file_name):
@@ -133,33 +117,14 @@ def cache_write(cache_object, cache_file_name):
     Function to write object to cache if cache file is older than cache_hours.
     '''
     cache_seconds = config.VOCAB_CACHE_HOURS * 3600
-    cache_file_path = os.path.join(config.VOCAB_CACHE_DIR, cache_file_name)
-    
-    if os.path.isfile(cache_file_path):
-        # if the cache file is older than VOCAB_CACHE_HOURS days, delete it
-        cache_file_age = time.time() - os.stat(cache_file_path).st_mtime
-        # if the cache file is older than VOCAB_CACHE_HOURS days, delete it
-        if cache_seconds and cache_file_age > cache_seconds:
-            logging.debug('Removing old cache file {}'.format(os.path.abspath(cache_file_path)))
-            os.remove(cache_file_path)
-        else:
-            logging.debug('Retaining recent cache file {}'.format(os.path.abspath(cache_file_path)))
-            return # Don't do anything - cache file is too young to die
+    cache_file_age = cache_age(cache_file_name)
 
-    try:
-        os.makedirs(config.VOCAB_CACHE_DIR)
-        logging.debug('Cache directory {} created'.format(os.path.abspath(config.VOCAB_CACHE_DIR)))
-    except OSError as exc:  # Python >2.5
-        if exc.errno == errno.EEXIST and os.path.isdir(config.VOCAB_CACHE_DIR):
-            pass
-        else:
-            raise   
-        
-    if cache_object: # Don't write empty file
-        with open(cache_file_path, 'wb') as cache_file:
-            pickle.dump(cache_object, cache_file)
-            cache_file.close()
-        logging.debug('Cache file {} written'.format(cache_file_path))
+    # if the cache file is no older than VOCAB_CACHE_HOURS, keep it
+    if cache_file_age is not None and not (cache_seconds and cache_file_age > cache_seconds):
+        logging.debug('Retaining recent cache file {}'.format(cache_file_name))
+        return # Don't do anything - cache file is too young to die
+
+    if cache_object: # Don't write empty object
+        cache_store.set(cache_file_name, cache_object)
     else:
         logging.debug('Empty object ignored')
-         
@@ -34,6 +34,8 @@ class SkosRegisterRenderer(RegisterRenderer):
             total,
             views=views
         )
+        # RegisterRenderer sets its own, from the keyword arguments it was given
+        self.template_extras = kwargs
 
     def render(self):
         """
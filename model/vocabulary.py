@@ -24,7 +24,8 @@ class Vocabulary:
             sparql_endpoint=None,
             collection_uris=None,
             sparql_username=None,
-            sparql_password=None
+            sparql_password=None,
+            hierarchy_page_size=None
     ):
         self.source = None
         self.id = id
@@ -53,6 +54,7 @@ class Vocabulary:
         self.collection_uris = collection_uris
         self.sparql_username = sparql_username
         self.sparql_password = sparql_password
+        self.hierarchy_page_size = hierarchy_page_size
 
 
 class VocabularyRenderer(Renderer):